@@ -184,3 +184,92 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Replay tool tuning
+
+# Number of concurrent requests while gathering local changesets from POSM's osm api
+CHANGESET_GATHER_WORKERS = int(os.environ.get('CHANGESET_GATHER_WORKERS', 4))
+# Limit on requests per second to POSM's osm api while gathering changesets, 0 to disable
+CHANGESET_GATHER_MAX_REQUESTS_PER_SEC = float(os.environ.get('CHANGESET_GATHER_MAX_REQUESTS_PER_SEC', 20))
+# How local changesets are gathered:
+#   api: download each changeset through POSM's osm api
+#   apidb: build the changesets straight from POSM's apidb tables
+CHANGESET_GATHER_MODE = os.environ.get('CHANGESET_GATHER_MODE', 'api')
+# Number of changesets read from apidb and saved at a time in apidb mode
+CHANGESET_EXPORT_BATCH_SIZE = int(os.environ.get('CHANGESET_EXPORT_BATCH_SIZE', 500))
+# Number of stored changesets loaded at a time while tracking elements and building the local aoi
+CHANGESET_READ_CHUNK_SIZE = int(os.environ.get('CHANGESET_READ_CHUNK_SIZE', 200))
+
+# Http client used for osm api and overpass requests
+HTTP_CONNECT_TIMEOUT_SECS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECS', 10))
+# Overpass sends nothing until the query is evaluated, so this needs to be longer than the query timeout
+HTTP_READ_TIMEOUT_SECS = float(os.environ.get('HTTP_READ_TIMEOUT_SECS', 300))
+# Retries on connection errors and 429/5xx responses, with exponential backoff
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 5))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+# Pooled connections per host, should not be less than CHANGESET_GATHER_WORKERS
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', max(10, CHANGESET_GATHER_WORKERS)))
+
+# Retries of the whole overpass download, on timeouts, dropped connections and overpass query timeouts.
+# Backoff doubles after each retry.
+OVERPASS_DOWNLOAD_RETRIES = int(os.environ.get('OVERPASS_DOWNLOAD_RETRIES', 3))
+OVERPASS_RETRY_BACKOFF_SECS = float(os.environ.get('OVERPASS_RETRY_BACKOFF_SECS', 10))
+
+# How the current upstream aoi extract is downloaded from overpass:
+#   full: a single query for the whole aoi bbox
+#   tiled: concurrent queries for tiles of the aoi bbox, merged into one extract (the merge holds all of the
+#          tiles in memory)
+#   targeted: only the elements referenced by local changesets, with their referring ways/relations
+#   adiff: apply upstream changes since the last full/tiled/adiff extract from an overpass augmented diff,
+#          falls back to full on errors or when there is no earlier extract
+UPSTREAM_EXTRACT_MODE = os.environ.get('UPSTREAM_EXTRACT_MODE', 'full')
+# Tile width and height in degrees in tiled mode
+UPSTREAM_EXTRACT_TILE_SIZE_DEG = float(os.environ.get('UPSTREAM_EXTRACT_TILE_SIZE_DEG', 0.05))
+# Element ids per overpass query in targeted mode
+UPSTREAM_EXTRACT_BATCH_SIZE = int(os.environ.get('UPSTREAM_EXTRACT_BATCH_SIZE', 2000))
+# Concurrent overpass queries in tiled and targeted modes, public overpass instances allow only a couple of slots per ip
+UPSTREAM_EXTRACT_WORKERS = int(os.environ.get('UPSTREAM_EXTRACT_WORKERS', 2))
+# Downloaded extracts are cached here, keyed by the query and the overpass data timestamp. Disabled when empty,
+# as by default, so that conflicts are detected against the latest upstream data. Cached files are trusted, so
+# the directory must not be writable by other users.
+UPSTREAM_EXTRACT_CACHE_DIR = os.environ.get('UPSTREAM_EXTRACT_CACHE_DIR', '')
+# Cached extracts whose data is older than this are downloaded again
+UPSTREAM_EXTRACT_CACHE_MAX_AGE_SECS = float(os.environ.get('UPSTREAM_EXTRACT_CACHE_MAX_AGE_SECS', 3600))
+# Least recently used extracts are removed once the cache grows beyond this
+UPSTREAM_EXTRACT_CACHE_MAX_SIZE_MB = int(os.environ.get('UPSTREAM_EXTRACT_CACHE_MAX_SIZE_MB', 2048))
+
+# How the local aoi extract is made:
+#   osmosis: export the aoi bbox from POSM's apidb with osmosis
+#   changesets: apply the tracked local changesets to the original aoi, without osmosis. The changes are
+#               held in memory while they are applied
+LOCAL_EXTRACT_MODE = os.environ.get('LOCAL_EXTRACT_MODE', 'osmosis')
+# Osmosis jobs for the local aoi extract are run on the host by scripts/pipe_reader_writer.sh,
+# through job files in this directory. It is inside the /tmp/osmosis_command mount of docker-compose.yml,
+# the runner finds it on the host at ./tmp/osmosis_command/jobs relative to the repo
+OSMOSIS_JOBS_DIR = os.environ.get('OSMOSIS_JOBS_DIR', '/tmp/osmosis_command/jobs')
+# The local aoi extract fails if osmosis does not finish in this time, the runner kills it then
+OSMOSIS_JOB_DEADLINE_SECS = float(os.environ.get('OSMOSIS_JOB_DEADLINE_SECS', 3600))
+# or if the job runner does not pick it up in this time
+OSMOSIS_JOB_PICKUP_TIMEOUT_SECS = float(os.environ.get('OSMOSIS_JOB_PICKUP_TIMEOUT_SECS', 30))
+
+# Osmium location index for the nodes of ways and relations shown with the conflicting elements,
+# one of osmium.index.map_types(). By default AOI files bigger than the threshold use a file based index.
+NODE_LOCATION_INDEX = os.environ.get('NODE_LOCATION_INDEX', '')
+NODE_LOCATION_INDEX_FILE_THRESHOLD_MB = float(os.environ.get('NODE_LOCATION_INDEX_FILE_THRESHOLD_MB', 256))
+
+# Processes scanning the original, local and upstream aoi files at the same time, 1 to scan them one by one
+AOI_SCAN_WORKERS = int(os.environ.get('AOI_SCAN_WORKERS', 3))
+
+# Look up the original aoi elements in a sqlite index of the file, built on first use, instead of scanning it
+ORIGINAL_AOI_INDEX_ENABLED = os.environ.get('ORIGINAL_AOI_INDEX_ENABLED', 'true').lower() == 'true'
+
+# Files of the pipeline runs, like the referenced osm files and checkpoints to resume later stages from.
+# Checkpoints are unpickled, so the directory must not be writable by other users. Defaults to
+# <aoi_root>/<aoi_name>/replay_workspace
+REPLAY_WORKSPACE_DIR = os.environ.get('REPLAY_WORKSPACE_DIR', '')
+REPLAY_WORKSPACE_KEEP_RUNS = int(os.environ.get('REPLAY_WORKSPACE_KEEP_RUNS', 2))
+
+# Skip local changesets created before the aoi directory while detecting conflicts. Off by default as
+# the aoi directory creation time changes when it is copied or moved around.
+SKIP_CHANGESETS_CREATED_BEFORE_AOI = os.environ.get('SKIP_CHANGESETS_CREATED_BEFORE_AOI', 'false').lower() == 'true'
@@ -0,0 +1,97 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from replay_tool.models import LocalChangeSet
+from replay_tool.utils.compression import decompress_text
+from replay_tool.utils.common import chunks
+from replay_tool.utils.osmium_handlers import OSMElementsTracker, ElementsFilterHandler
+
+
+TEXT_TABLE = 'benchmark_localchangeset_text'
+MB = 1024 * 1024
+
+
+def get_table_size(table_name: str) -> int:
+    with connection.cursor() as cur:
+        cur.execute('SELECT pg_total_relation_size(%s)', [table_name])
+        return cur.fetchone()[0]
+
+
+def read_and_parse(query: str, data_format: str, to_bytes) -> dict:
+    """Reads changeset data with the query and parses it with osmium, returns timing info"""
+    tracker = OSMElementsTracker()
+    handler = ElementsFilterHandler(tracker)
+    count = 0
+    start = time.perf_counter()
+    with connection.cursor() as cur:
+        cur.execute(query)
+        for rows in iter(lambda: cur.fetchmany(500), []):
+            for (data,) in rows:
+                handler.apply_buffer(to_bytes(data), data_format)
+                count += 1
+    return {'count': count, 'secs': time.perf_counter() - start}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the compressed storage of local changesets with plain text columns, '
+        'both for the table size and the read and parse throughput.'
+    )
+
+    def report(self, name, size, result, raw_bytes):
+        secs = result['secs'] or 1e-9
+        self.stdout.write(
+            f'{name:>10}: table {size / MB:9.2f} MB | '
+            f'read+parse {result["secs"]:7.2f} s, {result["count"] / secs:9.1f} changesets/s, '
+            f'{raw_bytes / MB / secs:8.2f} MB/s of xml'
+        )
+
+    def handle(self, *args, **options):
+        table = LocalChangeSet._meta.db_table
+        total = LocalChangeSet.objects.count()
+        if not total:
+            self.stdout.write('No local changesets to benchmark with.')
+            return
+
+        raw_bytes = 0
+        compressed_bytes = 0
+        with connection.cursor() as cur:
+            # Temporary table with the changesets stored the old way, as text
+            cur.execute(f'DROP TABLE IF EXISTS {TEXT_TABLE}')
+            cur.execute(
+                f'CREATE TEMPORARY TABLE {TEXT_TABLE} '
+                '(changeset_id integer PRIMARY KEY, changeset_meta text, changeset_data text)'
+            )
+            queryset = LocalChangeSet.objects.values_list('changeset_id', 'changeset_meta', 'changeset_data')
+            for rows in chunks(queryset.iterator(), 500):
+                text_rows = []
+                for changeset_id, meta, data in rows:
+                    data_xml = decompress_text(data)
+                    raw_bytes += len(data_xml.encode('utf-8'))
+                    compressed_bytes += len(data)
+                    text_rows.append((changeset_id, decompress_text(meta), data_xml))
+                cur.executemany(f'INSERT INTO {TEXT_TABLE} VALUES (%s, %s, %s)', text_rows)
+            cur.execute(f'ANALYZE {TEXT_TABLE}')
+
+        self.stdout.write(
+            f'{total} changesets, {raw_bytes / MB:.2f} MB of osmChange xml, '
+            f'{compressed_bytes / MB:.2f} MB compressed ({raw_bytes / max(compressed_bytes, 1):.1f}x)'
+        )
+
+        text_result = read_and_parse(
+            f'SELECT changeset_data FROM {TEXT_TABLE} ORDER BY changeset_id',
+            'osc',
+            lambda data: data.encode('utf-8'),
+        )
+        compressed_result = read_and_parse(
+            f'SELECT changeset_data FROM {table} ORDER BY changeset_id',
+            LocalChangeSet.DATA_FORMAT,
+            bytes,
+        )
+        self.report('text', get_table_size(TEXT_TABLE), text_result, raw_bytes)
+        self.report('compressed', get_table_size(table), compressed_result, raw_bytes)
+
+        with connection.cursor() as cur:
+            cur.execute(f'DROP TABLE {TEXT_TABLE}')
@@ -0,0 +1,67 @@
+import time
+
+import osmium
+
+from django.core.management.base import BaseCommand
+
+from replay_tool.serializers.osm import NodeSerializer, WaySerializer, RelationSerializer
+from replay_tool.utils.element_records import node_to_dict, way_to_dict, relation_to_dict
+
+
+class RecordsHandler(osmium.SimpleHandler):
+    def __init__(self, node_fn, way_fn, relation_fn):
+        super().__init__()
+        self.node_fn, self.way_fn, self.relation_fn = node_fn, way_fn, relation_fn
+        self.count = 0
+
+    def node(self, n):
+        self.node_fn(n)
+        self.count += 1
+
+    def way(self, w):
+        self.way_fn(w)
+        self.count += 1
+
+    def relation(self, r):
+        self.relation_fn(r)
+        self.count += 1
+
+
+def run(osm_path: str, node_fn, way_fn, relation_fn) -> dict:
+    handler = RecordsHandler(node_fn, way_fn, relation_fn)
+    start = time.perf_counter()
+    handler.apply_file(osm_path)
+    return {'count': handler.count, 'secs': time.perf_counter() - start}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares building the stored element data with the DRF serializers and with the '
+        'element record builders, over all the elements of an osm file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('osm_path', help='osm/pbf file to read the elements from')
+
+    def report(self, name, result, baseline=None):
+        secs = result['secs'] or 1e-9
+        speedup = f' ({baseline["secs"] / secs:.1f}x)' if baseline else ''
+        self.stdout.write(
+            f'{name:>8}: {result["secs"]:7.2f} s, {result["count"] / secs:11.1f} elements/s{speedup}'
+        )
+
+    def handle(self, *args, **options):
+        osm_path = options['osm_path']
+        # Reading alone, to tell the cost of building the data apart
+        read_result = run(osm_path, lambda n: None, lambda w: None, lambda r: None)
+        drf_result = run(
+            osm_path,
+            lambda n: NodeSerializer(n).data,
+            lambda w: WaySerializer(w).data,
+            lambda r: RelationSerializer(r).data,
+        )
+        records_result = run(osm_path, node_to_dict, way_to_dict, relation_to_dict)
+
+        self.report('read', read_result)
+        self.report('drf', drf_result)
+        self.report('records', records_result, drf_result)
@@ -0,0 +1,94 @@
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from replay_tool.utils.osmium_handlers import OSMElementsTracker, scan_aoi_file
+
+
+MB = 1024 * 1024
+# Nodes created nowadays have ids of this order
+IDS_START = 8 * 10 ** 9
+
+
+def create_tracker(ids_by_type: dict) -> OSMElementsTracker:
+    """Tracker with the ids as referenced and modified elements"""
+    tracker = OSMElementsTracker()
+    for etype, ids in ids_by_type.items():
+        tracker.referenced_elements[etype].update(ids)
+        tracker.modified_elements[etype].update(ids)
+    return tracker
+
+
+def measure_memory(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def time_lookups(tracked, probes: list) -> float:
+    """Seconds taken to check the probes in the union of tracked ids, as AOIHandler does"""
+    start = time.perf_counter()
+    for eid in probes:
+        eid in tracked
+    return time.perf_counter() - start
+
+
+def time_set_lookups(tracker, etype: str, probes: list) -> float:
+    """Seconds taken to check the probes in each of the tracked sets, as it was done before"""
+    referenced = tracker.referenced_elements[etype]
+    added = tracker.added_elements[etype]
+    deleted = tracker.deleted_elements[etype]
+    start = time.perf_counter()
+    for eid in probes:
+        eid in referenced or eid in added or eid in deleted
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures memory of the elements tracker and of the union of tracked ids built per scan, and '
+        'the speed of lookups in the union compared to the separate sets, optionally also an aoi file scan.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10 ** 6, help='number of tracked node ids')
+        parser.add_argument('--spread', type=int, default=50, help='tracked ids are one in this many ids')
+        parser.add_argument('--lookups', type=int, default=10 ** 6)
+        parser.add_argument('--osm-path', help='aoi file to scan with the tracker')
+
+    def handle(self, *args, **options):
+        size, spread = options['size'], options['spread']
+        random.seed(0)
+        ids = sorted(random.sample(range(IDS_START, IDS_START + size * spread), size))
+        # Most of the elements of an aoi are not tracked, but have ids in the same range as the tracked ones
+        hits = random.sample(ids, options['lookups'] // 10)
+        misses = [random.randrange(IDS_START, IDS_START + size * spread) for _ in range(options['lookups'] - len(hits))]
+        probes = hits + misses
+        random.shuffle(probes)
+
+        # ids are copied, like ints which come from osmium
+        tracker, memory = measure_memory(lambda: create_tracker({'nodes': [eid + 0 for eid in ids]}))
+        self.stdout.write(f'  tracker: 2 x {size} ids take {memory / MB:8.1f} MB')
+        tracked, memory = measure_memory(tracker.get_tracked_elements)
+        self.stdout.write(f'    union: {size} ids take {memory / MB:8.1f} MB more during a scan')
+
+        timings = (
+            ('3 sets', time_set_lookups(tracker, 'nodes', probes)),
+            ('union', time_lookups(tracked['nodes'], probes)),
+        )
+        for name, secs in timings:
+            self.stdout.write(f'{name:>9}: {len(probes) / secs:12.1f} lookups/s, 10% of them tracked')
+
+        if not options['osm_path']:
+            return
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            scan_aoi_file(tracker, options['osm_path'], os.path.join(tmp_dir, 'referenced.osm'))
+            self.stdout.write(f'scanned {options["osm_path"]} in {time.perf_counter() - start:.2f} s')
@@ -0,0 +1,68 @@
+from django.db import migrations, models
+
+from replay_tool.utils.compression import compress_text, decompress_text
+
+
+def compress_changesets(apps, schema_editor):
+    LocalChangeSet = apps.get_model('replay_tool', 'LocalChangeSet')
+    for changeset in LocalChangeSet.objects.iterator():
+        changeset.changeset_meta_gz = compress_text(changeset.changeset_meta)
+        changeset.changeset_data_gz = compress_text(changeset.changeset_data)
+        changeset.save(update_fields=['changeset_meta_gz', 'changeset_data_gz'])
+
+
+def decompress_changesets(apps, schema_editor):
+    LocalChangeSet = apps.get_model('replay_tool', 'LocalChangeSet')
+    for changeset in LocalChangeSet.objects.iterator():
+        changeset.changeset_meta = decompress_text(changeset.changeset_meta_gz)
+        changeset.changeset_data = decompress_text(changeset.changeset_data_gz)
+        changeset.save(update_fields=['changeset_meta', 'changeset_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('replay_tool', '0011_auto_20210329_0514'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='localchangeset',
+            name='changeset_meta_gz',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='changeset_data_gz',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(compress_changesets, decompress_changesets),
+        migrations.RemoveField(
+            model_name='localchangeset',
+            name='changeset_meta',
+        ),
+        migrations.RemoveField(
+            model_name='localchangeset',
+            name='changeset_data',
+        ),
+        migrations.RenameField(
+            model_name='localchangeset',
+            old_name='changeset_meta_gz',
+            new_name='changeset_meta',
+        ),
+        migrations.RenameField(
+            model_name='localchangeset',
+            old_name='changeset_data_gz',
+            new_name='changeset_data',
+        ),
+        migrations.AlterField(
+            model_name='localchangeset',
+            name='changeset_meta',
+            field=models.BinaryField(),
+        ),
+        migrations.AlterField(
+            model_name='localchangeset',
+            name='changeset_data',
+            field=models.BinaryField(),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-17 17:37
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('replay_tool', '0012_compress_localchangeset_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='replaytool',
+            name='progress',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 2.2.28 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+from replay_tool.utils.compression import decompress_text
+from replay_tool.utils.transformations import parse_changeset_meta
+
+
+META_FIELDS = ['created_at', 'num_changes', 'user', 'min_lat', 'min_lon', 'max_lat', 'max_lon']
+BATCH_SIZE = 500
+
+
+def parse_existing_changesets_meta(apps, schema_editor):
+    LocalChangeSet = apps.get_model('replay_tool', 'LocalChangeSet')
+    # Only the new columns are written, the compressed changeset data is not read or rewritten
+    changesets = LocalChangeSet.objects.only('id', 'changeset_meta').iterator(chunk_size=BATCH_SIZE)
+    batch = []
+    for changeset in changesets:
+        for attr, value in parse_changeset_meta(decompress_text(changeset.changeset_meta)).items():
+            setattr(changeset, attr, value)
+        batch.append(changeset)
+        if len(batch) == BATCH_SIZE:
+            LocalChangeSet.objects.bulk_update(batch, META_FIELDS)
+            batch = []
+    if batch:
+        LocalChangeSet.objects.bulk_update(batch, META_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('replay_tool', '0013_replaytool_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='localchangeset',
+            name='created_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='num_changes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='localchangeset',
+            name='user',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='localchangeset',
+            index=models.Index(
+                fields=['min_lat', 'max_lat', 'min_lon', 'max_lon'], name='replay_tool_min_lat_93a855_idx',
+            ),
+        ),
+        migrations.RunPython(parse_existing_changesets_meta, migrations.RunPython.noop),
+    ]
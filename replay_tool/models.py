@@ -6,7 +6,8 @@ from django.contrib.postgres.fields import JSONField
 from copy import deepcopy
 
 from .utils.elements_utils import get_osm_elems_diff, replace_new_element_ids
-from .utils.transformations import ChangesetsToXMLWriter
+from .utils.compression import compress_text, GZIPPED_OSM_CHANGE_FORMAT
+from .utils.transformations import ChangesetsToXMLWriter, parse_changeset_meta
 
 from mypy_extensions import TypedDict
 
@@ -195,6 +196,8 @@ class ReplayTool(models.Model):
     error_details = models.TextField(null=True, blank=True)
 
     elements_data = JSONField(default=dict)
+    # Progress of the current stage, see utils.progress.ProgressRecorder
+    progress = JSONField(default=dict)
 
     def __str__(self):
         return self.state
@@ -209,6 +212,7 @@ class ReplayTool(models.Model):
         r.state = cls.STATUS_NOT_TRIGGERRED
         r.is_current_state_complete = True
         r.elements_data = dict()
+        r.progress = dict()
         r.has_errored = False
         r.error_details = None
         # Delete other items
@@ -241,9 +245,12 @@ class LocalChangeSet(models.Model):
         (STATUS_PROCESSED, 'Processed'),
     )
 
+    # Format of changeset_data, as understood by osmium
+    DATA_FORMAT = GZIPPED_OSM_CHANGE_FORMAT
+
     changeset_id = models.PositiveIntegerField(unique=True)
-    changeset_meta = models.TextField()  # Stores xml meta
-    changeset_data = models.TextField()  # Stores xml data
+    changeset_meta = models.BinaryField()  # Stores gzipped xml meta
+    changeset_data = models.BinaryField()  # Stores gzipped xml data
 
     status = models.CharField(
         max_length=20,
@@ -251,9 +258,49 @@ class LocalChangeSet(models.Model):
         default=STATUS_NOT_PROCESSED
     )
 
+    # The following are parsed from changeset_meta, to filter changesets without reading the xml
+    created_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    num_changes = models.PositiveIntegerField(null=True, blank=True)
+    user = models.CharField(max_length=255, null=True, blank=True)
+    # Bounds, null if changeset has no located elements
+    min_lat = models.FloatField(null=True, blank=True)
+    min_lon = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['min_lat', 'max_lat', 'min_lon', 'max_lon']),
+        ]
+
     def __str__(self):
         return f'Local Changeset # {self.changeset_id}'
 
+    @classmethod
+    def from_xml(cls, changeset_id, meta_xml, data_xml):
+        return cls(
+            changeset_id=changeset_id,
+            changeset_meta=compress_text(meta_xml),
+            changeset_data=compress_text(data_xml),
+            **parse_changeset_meta(meta_xml),
+        )
+
+    @classmethod
+    def get_last_changeset_id(cls):
+        """High-water mark of the gathered changesets, changesets upto this id need not be gathered again"""
+        return cls.objects.aggregate(models.Max('changeset_id'))['changeset_id__max']
+
+    @classmethod
+    def get_unprocessed_changesets(cls):
+        return cls.objects.filter(status=cls.STATUS_NOT_PROCESSED).order_by('changeset_id')
+
+    @classmethod
+    def mark_processed(cls, changeset_ids):
+        cls.objects.filter(
+            status=cls.STATUS_NOT_PROCESSED,
+            changeset_id__in=changeset_ids,
+        ).update(status=cls.STATUS_PROCESSED)
+
 
 class UpstreamChangeSet(models.Model):
     changeset_id = models.BigIntegerField(unique=True)
@@ -1,13 +1,16 @@
-import requests
-import time
 import os
-import tempfile
+import shlex
+
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-import psycopg2
 import osm2geojson
 
+from django.conf import settings
 from django.db import transaction, models
-from typing import NewType, Tuple
+from django.utils import timezone
+from typing import Callable, Dict, Iterable, Iterator, List, NewType, Optional, Set, Tuple
 
 from posm_replay.celery import app
 
@@ -17,23 +20,55 @@ from .models import (
 )
 
 from .utils.decorators import set_error_status_on_exception
+from .utils.http import get_http_client
+from .utils.harvester import ChangesetHarvester, HarvestedChangeset
+from .utils.apidb import (
+    get_apidb_connection,
+    get_new_changeset_ids as get_new_changeset_ids_from_apidb,
+    export_changesets,
+)
+from .utils.progress import ProgressRecorder
+from .utils.overpass import (
+    download_overpass_query,
+    download_overpass_queries,
+    download_tiled_overpass_query,
+    adiff_to_osmchange,
+)
+from .utils.osm_files import apply_osm_changes, apply_osm_change_buffers
+from .utils.extract_cache import get_extract_cache
+from .utils.osmosis import run_osmosis_job
 from .utils.osm_api import (
     get_changeset_data,
     get_changeset_meta,
 )
+from .utils.aoi_index import scan_aoi_index
+from .utils.workspace import create_run_workspace, save_checkpoint, load_checkpoint
 from .utils.osmium_handlers import (
     OSMElementsTracker,
     ElementsFilterHandler,
-    AOIHandler,
-    VersionHandler,
+    ChangesetElementsHandler,
+    AOIScanResult,
+    scan_aoi_file,
 )
 from .utils.common import (
-    get_aoi_path,
+    get_aoi_name,
     get_original_aoi_path,
+    get_original_aoi_index_path,
+    get_workspace_path,
     get_current_aoi_info,
     get_current_aoi_path,
+    get_local_aoi_path,
+    get_aoi_created_datetime,
     get_overpass_query,
+    get_overpass_adiff_query,
+    get_overpass_elements_queries,
+    get_pushed_changeset_ids,
+    load_current_aoi_state,
+    save_current_aoi_state,
     filter_elements_from_aoi_handler,
+    chunks,
+
+    LOCAL_AOI_FILE_NAME,
 
     # Typings
     FilteredElements,
@@ -53,48 +88,79 @@ logger = logging.getLogger(__name__)
 OVERPASS_API_URL = 'http://overpass-api.de/api/interpreter'
 OSM_API_MAX_ELEMENTS_LIMIT = 10000
 
-OSMOSIS_COMMAND_TIMEOUT_SECS = 10
 
 ElementTypeStr = NewType('ElementTypeStr', str)
-AOIHandlerTriplet = NewType('AOIHandlerTriplet', Tuple[AOIHandler, AOIHandler, AOIHandler])
+AOIScanResultTriplet = NewType('AOIScanResultTriplet', Tuple[AOIScanResult, AOIScanResult, AOIScanResult])
 
 
-def get_first_changeset_id() -> int:
-    config = ReplayToolConfig.load()
-    db_config = {
-        'host': config.posm_db_host,
-        'dbname': config.posm_db_name,
-        'user': config.posm_db_user,
-        'password': config.posm_db_password,
-    }
-    with psycopg2.connect(**db_config) as conn:
-        with conn.cursor() as cur:
-            changeset_query = 'select id from changesets where num_changes > 0 order by id asc limit 1;'
-            cur.execute(changeset_query)
-            row = cur.fetchone()
-            return row[0]
+CHANGESET_GATHER_MODE_API = 'api'
+CHANGESET_GATHER_MODE_APIDB = 'apidb'
+
+UPSTREAM_EXTRACT_MODE_FULL = 'full'
+UPSTREAM_EXTRACT_MODE_TILED = 'tiled'
+UPSTREAM_EXTRACT_MODE_TARGETED = 'targeted'
+UPSTREAM_EXTRACT_MODE_ADIFF = 'adiff'
+# Modes whose extract has the whole aoi bbox, which upstream changes can be applied to
+UPSTREAM_BBOX_EXTRACT_MODES = (UPSTREAM_EXTRACT_MODE_FULL, UPSTREAM_EXTRACT_MODE_TILED, UPSTREAM_EXTRACT_MODE_ADIFF)
+
+LOCAL_EXTRACT_MODE_CHANGESETS = 'changesets'
+LOCAL_EXTRACT_MODE_OSMOSIS = 'osmosis'
+
+
+def get_new_changeset_ids(after_changeset_id) -> List[int]:
+    # psycopg2 connection as context manager only ends the transaction, it doesn't close the connection
+    with closing(get_apidb_connection()) as conn:
+        return get_new_changeset_ids_from_apidb(conn, after_changeset_id)
+
+
+def save_changesets(changesets: List[HarvestedChangeset]):
+    LocalChangeSet.objects.bulk_create(
+        [
+            LocalChangeSet.from_xml(changeset_id, meta_data, data)
+            for changeset_id, meta_data, data in changesets
+        ],
+        # Rows left by an interrupted gathering are kept as they are
+        ignore_conflicts=True,
+    )
 
 
-def collect_changesets_from_apidb(first_changeset_id):
+def harvest_changesets_from_api(changeset_ids: List[int]) -> Iterable[List[HarvestedChangeset]]:
     config = ReplayToolConfig.load()
-    changeset_id = first_changeset_id
-    while True:
-        meta_data = get_changeset_meta(changeset_id, config)
-        if meta_data is None:
-            break
-        time.sleep(0.1)
-        # Increment changeset id to get next one
-        data = get_changeset_data(changeset_id, config)
-
-        # Save changeset to db
-        LocalChangeSet.objects.create(
-            changeset_id=changeset_id,
-            changeset_meta=meta_data,
-            changeset_data=data
-        )
-        time.sleep(0.1)
+    harvester = ChangesetHarvester(
+        fetch_meta=lambda changeset_id: get_changeset_meta(changeset_id, config),
+        fetch_data=lambda changeset_id: get_changeset_data(changeset_id, config),
+        workers=settings.CHANGESET_GATHER_WORKERS,
+        max_per_sec=settings.CHANGESET_GATHER_MAX_REQUESTS_PER_SEC,
+    )
+    return harvester.harvest(changeset_ids)
+
+
+def export_changesets_from_apidb(changeset_ids: List[int]) -> Iterable[List[HarvestedChangeset]]:
+    batch_size = settings.CHANGESET_EXPORT_BATCH_SIZE
+    # Also closed if the batches are not read to the end
+    with closing(get_apidb_connection()) as conn:
+        changesets = export_changesets(conn, changeset_ids[0], changeset_ids[-1], itersize=batch_size)
+        yield from chunks(changesets, batch_size)
+
 
-        changeset_id += 1
+def collect_changesets_from_apidb(changeset_ids: List[int]):
+    if not changeset_ids:
+        return True
+
+    mode = settings.CHANGESET_GATHER_MODE
+    if mode == CHANGESET_GATHER_MODE_APIDB:
+        batches = export_changesets_from_apidb(changeset_ids)
+    elif mode == CHANGESET_GATHER_MODE_API:
+        batches = harvest_changesets_from_api(changeset_ids)
+    else:
+        raise Exception(f'Invalid changeset gather mode "{mode}"')
+
+    progress = ProgressRecorder(ReplayTool.STATUS_GATHERING_CHANGESETS, len(changeset_ids))
+    # Batches come in increasing changeset id order
+    for batch in batches:
+        save_changesets(batch)
+        progress.advance(len(batch))
+    progress.finish()
 
     return True
 
@@ -104,32 +170,41 @@ def collect_changesets_from_apidb(first_changeset_id):
     curr_state=ReplayTool.STATUS_GATHERING_CHANGESETS
 )
 def gather_changesets():
+    # Only gather changesets newer than the ones already gathered
+    last_changeset_id = LocalChangeSet.get_last_changeset_id() or 0
     try:
-        first_changeset_id = get_first_changeset_id()
+        changeset_ids = get_new_changeset_ids(last_changeset_id)
     except Exception as e:
-        logger.warning('Error getting first changeset id', exc_info=True)
+        logger.warning('Error getting new changeset ids', exc_info=True)
         raise e
+    logger.info(f'Gathering {len(changeset_ids)} changesets newer than {last_changeset_id}')
 
     # Now collect changesets
     try:
-        collect_changesets_from_apidb(first_changeset_id)
+        collect_changesets_from_apidb(changeset_ids)
     except Exception as e:
         logger.warning('Error collecting changesets from apidb', exc_info=True)
         raise e
+    finally:
+        get_http_client().log_latency_stats()
 
 
-def get_original_element_versions():
-    original_aoi_path = get_original_aoi_path()
-    version_handler = VersionHandler()
-    version_handler.apply_file(original_aoi_path)
-    return version_handler
+def build_local_aoi_from_changesets():
+    """
+    Local state of the aoi is the original aoi with the local changesets applied, so build it in one
+    pass instead of exporting it from apidb. Only the changesets which are tracked are applied, the
+    others are already pushed or don't affect the aoi.
+    """
+    apply_osm_change_buffers(
+        get_original_aoi_path(),
+        get_trackable_changesets_data(),
+        LocalChangeSet.DATA_FORMAT,
+        get_local_aoi_path(),
+    )
+    return True
 
 
-@set_error_status_on_exception(
-    prev_state=ReplayTool.STATUS_EXTRACTING_UPSTREAM_AOI,
-    curr_state=ReplayTool.STATUS_EXTRACTING_LOCAL_AOI
-)
-def get_local_aoi_extract():
+def export_local_aoi_with_osmosis():
     config = ReplayToolConfig.load()
     db_user = config.posm_db_user
     db_password = config.posm_db_password
@@ -141,29 +216,106 @@ def get_local_aoi_extract():
         raise Exception(
             'osmosis_aoi_root, aoi_name, osmosis_db_host, posm_db_user and posm_db_password must all be configured')
 
-    path = os.path.join(osmosis_aoi_root, aoi_name, 'local_aoi.osm')
-    command = f'''osmosis --read-apidb host={osmosis_db_host} user={db_user} \
-        password={db_password} validateSchemaVersion=no --write-xml file={path}
-    '''
-    # Write command to named pipe
-    with open('/tmp/osmosis_command/command_reader.fifo', 'w') as f:
-        f.write(command)
-
-    # wait
-    time.sleep(OSMOSIS_COMMAND_TIMEOUT_SECS)
-
-    # Read result
-    with open('/tmp/osmosis_command/result_reader.fifo') as f:
-        # Read the last line
-        lines = [x for x in f.readlines() if x]
-        if not lines:
-            raise ('Time out while waiting for osmosis result')
-        line = lines[-1]
-        [err_code, *msg] = line.strip().split()
-        if err_code == '0':
-            return True
-        else:
-            raise Exception(' '.join(msg))
+    # Only the aoi bbox is extracted, with complete ways and relations so that the elements crossing
+    # the bbox edges are still valid
+    [w, s, e, n] = get_current_aoi_info()['bbox']
+    path = os.path.join(osmosis_aoi_root, aoi_name, LOCAL_AOI_FILE_NAME)
+    # Credentials go to an authFile only the job runner can read, not into the command
+    command = (
+        'osmosis --read-apidb authFile="$JOB_AUTH_FILE" validateSchemaVersion=no '
+        f'--bounding-box left={w} bottom={s} right={e} top={n} completeWays=yes completeRelations=yes '
+        f'--write-pbf file={shlex.quote(path)}'
+    )
+    run_osmosis_job(
+        settings.OSMOSIS_JOBS_DIR,
+        command,
+        deadline_secs=settings.OSMOSIS_JOB_DEADLINE_SECS,
+        pickup_timeout_secs=settings.OSMOSIS_JOB_PICKUP_TIMEOUT_SECS,
+        auth={'host': osmosis_db_host, 'user': db_user, 'password': db_password},
+    )
+    return True
+
+
+@set_error_status_on_exception(
+    prev_state=ReplayTool.STATUS_EXTRACTING_UPSTREAM_AOI,
+    curr_state=ReplayTool.STATUS_EXTRACTING_LOCAL_AOI
+)
+def get_local_aoi_extract():
+    if settings.LOCAL_EXTRACT_MODE == LOCAL_EXTRACT_MODE_CHANGESETS:
+        return build_local_aoi_from_changesets()
+    elif settings.LOCAL_EXTRACT_MODE == LOCAL_EXTRACT_MODE_OSMOSIS:
+        return export_local_aoi_with_osmosis()
+    raise Exception(f'Invalid LOCAL_EXTRACT_MODE: {settings.LOCAL_EXTRACT_MODE}')
+
+
+def download_upstream_aoi_extract(mode: str, bbox: List[float], **download_options) -> Optional[str]:
+    """Downloads the upstream aoi to <aoi_path>/current_aoi.osm, returns osm_base timestamp of the data"""
+    overpass_api_url = ReplayToolConfig.load().overpass_api_url
+    if mode == UPSTREAM_EXTRACT_MODE_TILED:
+        return download_tiled_overpass_query(
+            overpass_api_url,
+            get_overpass_query,
+            bbox,
+            get_current_aoi_path(),
+            tile_size=settings.UPSTREAM_EXTRACT_TILE_SIZE_DEG,
+            workers=settings.UPSTREAM_EXTRACT_WORKERS,
+            **download_options,
+        )
+    elif mode == UPSTREAM_EXTRACT_MODE_TARGETED:
+        # Only the elements the conflict detection looks at are needed from upstream
+        tracker = track_elements_from_local_changesets()
+        queries = get_overpass_elements_queries(tracker.referenced_elements, settings.UPSTREAM_EXTRACT_BATCH_SIZE)
+        logger.info(f'Downloading referenced upstream elements in {len(queries)} batches')
+        return download_overpass_queries(
+            overpass_api_url,
+            queries,
+            get_current_aoi_path(),
+            workers=settings.UPSTREAM_EXTRACT_WORKERS,
+            **download_options,
+        )
+    elif mode == UPSTREAM_EXTRACT_MODE_FULL:
+        [w, s, e, n] = bbox
+        return download_overpass_query(
+            overpass_api_url, get_overpass_query(s, w, n, e), get_current_aoi_path(), **download_options,
+        )
+    raise Exception(f'Invalid UPSTREAM_EXTRACT_MODE: {mode}')
+
+
+def get_refreshable_osm_base(bbox: List[float]) -> Optional[str]:
+    """osm_base timestamp of the current aoi extract, if it is an extract of the whole bbox"""
+    state = load_current_aoi_state()
+    if state and state.get('osm_base') and state.get('bbox') == bbox \
+            and state.get('mode') in UPSTREAM_BBOX_EXTRACT_MODES and os.path.exists(get_current_aoi_path()):
+        return state['osm_base']
+    return None
+
+
+def refresh_upstream_aoi_extract(bbox: List[float], since: str, **download_options) -> Optional[str]:
+    """
+    Brings <aoi_path>/current_aoi.osm up to date by applying the upstream changes in the aoi bbox
+    since its osm_base timestamp. Returns osm_base timestamp of the data.
+    """
+    current_aoi_path = get_current_aoi_path()
+    overpass_api_url = ReplayToolConfig.load().overpass_api_url
+    adiff_path = f'{current_aoi_path}.adiff'
+    osc_path = f'{current_aoi_path}.osc'
+    [w, s, e, n] = bbox
+    try:
+        # Augmented diffs are not cached, a diff since an old timestamp is of no use later
+        osm_base = download_overpass_query(
+            overpass_api_url,
+            get_overpass_adiff_query(since, s, w, n, e),
+            adiff_path,
+            **{**download_options, 'cache': None},
+        )
+        changes_count = adiff_to_osmchange(adiff_path, osc_path)
+        logger.info(f'Applying {changes_count} upstream changes since {since}')
+        apply_osm_changes(current_aoi_path, [osc_path], current_aoi_path)
+    finally:
+        for path in (adiff_path, osc_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return osm_base
 
 
 @set_error_status_on_exception(
@@ -171,50 +323,160 @@ def get_local_aoi_extract():
     curr_state=ReplayTool.STATUS_EXTRACTING_UPSTREAM_AOI
 )
 def get_current_aoi_extract():
-    [w, s, e, n] = get_current_aoi_info()['bbox']
-    overpass_query = get_overpass_query(s, w, n, e)
-    overpass_api_url = ReplayToolConfig.load().overpass_api_url
-    response = requests.get(overpass_api_url, data={'data': overpass_query})
+    bbox = get_current_aoi_info()['bbox']
+    mode = settings.UPSTREAM_EXTRACT_MODE
+    download_options = {
+        'retries': settings.OVERPASS_DOWNLOAD_RETRIES,
+        'backoff_secs': settings.OVERPASS_RETRY_BACKOFF_SECS,
+        'cache': get_extract_cache(),
+    }
 
-    # Write response to <aoi_path>/current_aoi.osm
-    with open(get_current_aoi_path(), 'wb') as f:
-        f.write(response.content)
+    osm_base = None
+    if mode == UPSTREAM_EXTRACT_MODE_ADIFF:
+        since = get_refreshable_osm_base(bbox)
+        if since is None:
+            # Without the osm_base of an earlier extract there is no reliable timestamp to diff from
+            logger.info('No earlier upstream aoi extract to refresh, extracting it in full')
+            mode = UPSTREAM_EXTRACT_MODE_FULL
+        else:
+            try:
+                osm_base = refresh_upstream_aoi_extract(bbox, since, **download_options)
+            except Exception:
+                logger.warning('Could not refresh upstream aoi extract, extracting it again', exc_info=True)
+                mode = UPSTREAM_EXTRACT_MODE_FULL
+    if mode != UPSTREAM_EXTRACT_MODE_ADIFF:
+        osm_base = download_upstream_aoi_extract(mode, bbox, **download_options)
+
+    # Record how the extract was made, so that the next run can refresh it instead
+    save_current_aoi_state({'mode': mode, 'bbox': bbox, 'osm_base': osm_base})
     return True
 
 
-def track_elements_from_local_changesets() -> OSMElementsTracker:
-    tracker = OSMElementsTracker()
-    for changeset in LocalChangeSet.objects.all():
-        # Create named temp file
-        tf = tempfile.NamedTemporaryFile(suffix='.osc')
-        tf.write(changeset.changeset_data.encode('utf-8'))
-        tf.seek(0)
-        filter_handler = ElementsFilterHandler(tracker)
-        filter_handler.apply_file(tf.name)
+def get_trackable_changesets() -> models.QuerySet:
+    """
+    Unprocessed changesets which can affect the aoi. Changesets are skipped if their bounds lie
+    completely outside the aoi bbox and optionally if they were created before the aoi.
+    """
+    changesets = LocalChangeSet.get_unprocessed_changesets()
+    [w, s, e, n] = get_current_aoi_info()['bbox']
+    trackable_changesets = changesets.filter(
+        # Changesets without bounds can't be filtered out
+        models.Q(min_lat__isnull=True) |
+        models.Q(min_lat__lte=n, max_lat__gte=s, min_lon__lte=e, max_lon__gte=w)
+    )
+    if settings.SKIP_CHANGESETS_CREATED_BEFORE_AOI:
+        aoi_created_at = timezone.make_aware(get_aoi_created_datetime(), timezone.utc)
+        trackable_changesets = trackable_changesets.filter(
+            models.Q(created_at__isnull=True) | models.Q(created_at__gte=aoi_created_at)
+        )
+    logger.info(f'Tracking {trackable_changesets.count()} of {changesets.count()} unprocessed changesets')
+    return trackable_changesets
 
-    # Now we have refed/added/modified/deleted nodes in tracker
-    return tracker
 
+def get_trackable_changesets_data() -> Iterator[bytes]:
+    # Changesets already pushed upstream need not be tracked again.
+    # Only a chunk of changesets is loaded at a time, in changeset order as the tracking depends on it
+    changesets_data = get_trackable_changesets().values_list('changeset_data', flat=True).iterator(
+        chunk_size=settings.CHANGESET_READ_CHUNK_SIZE,
+    )
+    for data in changesets_data:
+        yield bytes(data)
 
-def track_elements_and_get_aoi_handlers(tracker: OSMElementsTracker) -> Tuple[AOIHandler, AOIHandler, AOIHandler]:
-    aoi_path = get_aoi_path()
-    local_aoi_path = os.path.join(aoi_path, 'local_aoi.osm')
-    current_aoi_path = os.path.join(aoi_path, 'current_aoi.osm')
-    original_aoi_path = get_original_aoi_path()
 
-    original_aoi_handler = AOIHandler(tracker, '/tmp/original_referenced.osm')
-    original_aoi_handler.apply_file_and_cleanup(original_aoi_path)
+def apply_to_trackable_changesets(handler) -> None:
+    for data in get_trackable_changesets_data():
+        # osmium decompresses the stored data itself
+        handler.apply_buffer(data, LocalChangeSet.DATA_FORMAT)
 
-    local_aoi_handler = AOIHandler(tracker, '/tmp/local_referenced.osm')
-    local_aoi_handler.apply_file_and_cleanup(local_aoi_path)
 
-    upstream_aoi_handler = AOIHandler(tracker, '/tmp/upstream_referenced.osm')
-    upstream_aoi_handler.apply_file_and_cleanup(current_aoi_path)
+def track_elements_from_local_changesets() -> OSMElementsTracker:
+    tracker = OSMElementsTracker()
+    apply_to_trackable_changesets(ElementsFilterHandler(tracker))
 
+    # Now we have refed/added/modified/deleted nodes in tracker
+    return tracker
+
+
+def add_missing_local_elements(tracker: OSMElementsTracker, local_aoi_handler: AOIScanResult) -> None:
+    """
+    Adds to the local aoi scan result the added and modified elements which are not in the local extract,
+    like elements outside of the osmosis bounding box, with their latest data from the local changesets
+    """
+    missing = tracker.get_missing_elements(local_aoi_handler)
+    count = sum(len(ids) for ids in missing.values())
+    if not count:
+        return
+    logger.warning(f'{count} added or modified elements are not in the local extract, reading them from changesets')
+    handler = ChangesetElementsHandler(missing)
+    apply_to_trackable_changesets(handler)
+    for etype in missing:
+        getattr(local_aoi_handler, etype).update(getattr(handler, etype))
+
+
+def get_node_location_index(aoi_file_path: str) -> str:
+    """Location index type for AOIHandler, small AOIs keep the locations in memory and big ones in a file"""
+    if settings.NODE_LOCATION_INDEX:
+        return settings.NODE_LOCATION_INDEX
+    size_mb = os.path.getsize(aoi_file_path) / (1024 * 1024)
+    if size_mb > settings.NODE_LOCATION_INDEX_FILE_THRESHOLD_MB:
+        return 'sparse_file_array'
+    return 'sparse_mem_array'
+
+
+def scan_aoi_files(scans: List[Tuple[Callable, dict]]) -> List[AOIScanResult]:
+    """
+    Runs each of the scan functions in `scans` with its kwargs, in a pool of processes when configured.
+    Falls back to scanning one by one when processes can't be started, like in daemonic celery workers.
+    """
+    workers = min(settings.AOI_SCAN_WORKERS, len(scans))
+    if workers <= 1:
+        return [scan(**kwargs) for scan, kwargs in scans]
+    executor = None
+    try:
+        # Worker processes are started on submit, daemonic processes fail there with an AssertionError
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = [executor.submit(scan, **kwargs) for scan, kwargs in scans]
+    except (AssertionError, BrokenProcessPool, OSError):
+        logger.warning('Could not scan aoi files in parallel, scanning one by one', exc_info=True)
+        if executor:
+            executor.shutdown(wait=False)
+        return [scan(**kwargs) for scan, kwargs in scans]
+    # Errors of the scans themselves are not retried one by one, they would fail again
+    with executor:
+        return [future.result() for future in futures]
+
+
+def track_elements_and_get_aoi_handlers(tracker: OSMElementsTracker, run_dir: str) -> AOIScanResultTriplet:
+    """
+    Scans the original, local and upstream aoi files, the scans are independent of each other.
+    The referenced elements are written to osm files in the run directory.
+    Versions of the original elements are collected in the same pass over the original aoi.
+    The original aoi does not change, so its elements are looked up in its index when enabled.
+    """
+    original_scan = {
+        'filename': get_original_aoi_path(),
+        'ref_osm_path': os.path.join(run_dir, 'original_referenced.osm'),
+        'collect_versions': True,
+    }
+    if settings.ORIGINAL_AOI_INDEX_ENABLED:
+        original_scan['index_path'] = get_original_aoi_index_path()
+        scans = [(scan_aoi_index, original_scan)]
+    else:
+        original_scan['location_index'] = get_node_location_index(original_scan['filename'])
+        scans = [(scan_aoi_file, original_scan)]
+    for scan in [
+        {'filename': get_local_aoi_path(), 'ref_osm_path': os.path.join(run_dir, 'local_referenced.osm')},
+        {'filename': get_current_aoi_path(), 'ref_osm_path': os.path.join(run_dir, 'upstream_referenced.osm')},
+    ]:
+        scan['location_index'] = get_node_location_index(scan['filename'])
+        scans.append((scan_aoi_file, scan))
+    for _, scan in scans:
+        scan['tracker'] = tracker
+    original_aoi_handler, local_aoi_handler, upstream_aoi_handler = scan_aoi_files(scans)
     return original_aoi_handler, local_aoi_handler, upstream_aoi_handler
 
 
-def save_elements_count_data(local_aoi_handler: AOIHandler, upstream_aoi_handler: AOIHandler):
+def save_elements_count_data(local_aoi_handler: AOIScanResult, upstream_aoi_handler: AOIScanResult):
     # Add total count data to replay_tool
     tool = ReplayTool.objects.get()
     tool.elements_data = {
@@ -366,12 +628,14 @@ def get_referenced_and_deleted_elements(elements: FilteredElements) -> dict:
     curr_state=ReplayTool.STATUS_DETECTING_CONFLICTS
 )
 def filter_referenced_elements_and_detect_conflicts():
+    run_dir = create_run_workspace(get_workspace_path(), settings.REPLAY_WORKSPACE_KEEP_RUNS)
     tracker = track_elements_from_local_changesets()
-    handlers: AOIHandlerTriplet = track_elements_and_get_aoi_handlers(tracker)
+    handlers: AOIScanResultTriplet = track_elements_and_get_aoi_handlers(tracker, run_dir)
     original_aoi_handler, local_aoi_handler, upstream_aoi_handler = handlers
+    add_missing_local_elements(tracker, local_aoi_handler)
 
-    # Get versions
-    version_handler: VersionHandler = get_original_element_versions()
+    # Versions of the original elements
+    version_handler: AOIScanResult = original_aoi_handler
 
     save_elements_count_data(local_aoi_handler, upstream_aoi_handler)
 
@@ -468,9 +732,22 @@ def filter_referenced_elements_and_detect_conflicts():
         referrer = OSMElement.objects.get(element_id=referring_relation_id, type=OSMElement.TYPE_RELATION)
         node.reffered_by = referrer
         node.save()
+
+    # Later stages can start from here without scanning the aoi files again
+    save_checkpoint(
+        get_workspace_path(), run_dir, ReplayTool.STATUS_DETECTING_CONFLICTS, (tracker, handlers),
+        aoi_name=get_aoi_name(),
+    )
     return original_aoi_handler, local_aoi_handler, upstream_aoi_handler
 
 
+def load_conflicts_detection_checkpoint() -> Tuple[OSMElementsTracker, AOIScanResultTriplet]:
+    """Tracker and aoi scan results of the last conflicts detection for the current aoi"""
+    return load_checkpoint(
+        get_workspace_path(), ReplayTool.STATUS_DETECTING_CONFLICTS, aoi_name=get_aoi_name(),
+    )
+
+
 @set_error_status_on_exception(
     prev_state=ReplayTool.STATUS_DETECTING_CONFLICTS,
     curr_state=ReplayTool.STATUS_CREATING_GEOJSONS,
@@ -556,7 +833,7 @@ def create_and_push_changeset(osm_backend):
             # Close the changeset
             osm_oauth_backend.close_changeset(changeset.changeset_id)
 
-            all_elems.objects.update(status=OSMElement.STATUS_PUSHED)
+            all_elems.update(status=OSMElement.STATUS_PUSHED)
             # Return if there are no more unpushed elemenets
             if OSMElement.get_unpushed_elements().count() == 0:
                 return
@@ -606,7 +883,32 @@ def create_and_push_changeset(osm_backend):
 
         _do_push(osm_oauth_backend, to_push_elements_ids)
 
+    last_changeset_id = LocalChangeSet.get_last_changeset_id()
     _do_push(osm_backend)
+    if last_changeset_id is not None:
+        mark_pushed_changesets_processed(last_changeset_id)
+
+
+def mark_pushed_changesets_processed(last_changeset_id: int) -> None:
+    """
+    Marks the changesets upto last_changeset_id, whose changes are all upstream now, processed.
+    Changesets with elements which are not pushed, like unresolved conflicts, are tracked again in the next run.
+    """
+    not_pushed: Dict[str, Set[int]] = {'nodes': set(), 'ways': set(), 'relations': set()}
+    elements = OSMElement.objects.exclude(
+        local_state=OSMElement.LOCAL_STATE_REFERRING,
+    ).exclude(status=OSMElement.STATUS_PUSHED).values_list('type', 'element_id')
+    tracker_types = {
+        OSMElement.TYPE_NODE: 'nodes', OSMElement.TYPE_WAY: 'ways', OSMElement.TYPE_RELATION: 'relations',
+    }
+    for etype, eid in elements.iterator():
+        not_pushed[tracker_types[etype]].add(eid)
+
+    changesets = LocalChangeSet.get_unprocessed_changesets().filter(
+        changeset_id__lte=last_changeset_id,
+    ).values_list('changeset_id', 'changeset_data').iterator(chunk_size=settings.CHANGESET_READ_CHUNK_SIZE)
+    for batch in chunks(changesets, settings.CHANGESET_READ_CHUNK_SIZE):
+        LocalChangeSet.mark_processed(get_pushed_changeset_ids(batch, not_pushed))
 
 
 @app.task
@@ -642,6 +944,9 @@ def task_prepare_data_for_replay_tool(start_state: str = None):
         original_handler, local_handler, upstream_handler = \
             filter_referenced_elements_and_detect_conflicts()
         logger.info("Filtered referenced elements")
+    elif state_order[start_state] <= state_order[RT.STATUS_DETECTING_CONFLICTS]:
+        logger.info("Loading referenced elements from the last conflicts detection")
+        _, (original_handler, local_handler, upstream_handler) = load_conflicts_detection_checkpoint()
 
     if start_state is None or state_order[start_state] <= state_order[RT.STATUS_DETECTING_CONFLICTS]:
         logger.info("Generating geojsons")
@@ -1,7 +1,128 @@
-from replay_tool.utils.osmium_handlers import AOIHandler
+import os
+import pickle
+
+import pytest
+
+from replay_tool.utils.compression import compress_text, GZIPPED_OSM_CHANGE_FORMAT
+from replay_tool.utils.osmium_handlers import (
+    AOIHandler,
+    ChangesetElementsHandler,
+    OSMElementsTracker,
+    ElementsFilterHandler,
+    VersionHandler,
+    scan_aoi_file,
+)
 
 
 def test_aoi_handler():
     aoihandler = AOIHandler()
     aoihandler.apply_file('osm_test_data/osm.osm')
     # TODO: complete this
+
+
+def test_elements_filter_handler_tracks_changesets_in_order():
+    tracker = OSMElementsTracker()
+    handler = ElementsFilterHandler(tracker)
+    # Same handler is applied to each changeset
+    for changeset in [
+        '<osmChange version="0.6"><create><node id="1" version="1" lat="1" lon="1"/></create>'
+        '<modify><node id="2" version="2" lat="1" lon="1"/></modify></osmChange>',
+        '<osmChange version="0.6"><delete><node id="1" version="2"/><node id="3" version="4"/></delete></osmChange>',
+    ]:
+        handler.apply_buffer(compress_text(changeset), GZIPPED_OSM_CHANGE_FORMAT)
+
+    # Node added and then deleted locally is not tracked at all
+    assert tracker.added_elements['nodes'] == set()
+    assert tracker.modified_elements['nodes'] == {2}
+    assert tracker.deleted_elements['nodes'] == {3}
+    assert tracker.referenced_elements['nodes'] == {2, 3}
+
+
+@pytest.mark.parametrize('location_index', ['sparse_mem_array', 'sparse_file_array'])
+def test_aoi_handler_keeps_only_needed_elements(tmp_path, location_index):
+    aoi_path = tmp_path / 'aoi.osm'
+    nodes = ''.join(f'<node id="{i}" version="1" lat="1" lon="1" user="u" uid="1" changeset="1"/>' for i in range(1, 9))
+    # A tagged way node
+    nodes = nodes.replace('<node id="4" version="1" lat="1" lon="1" user="u" uid="1" changeset="1"/>',
+                          '<node id="4" version="3" lat="1" lon="1"><tag k="amenity" v="cafe"/></node>')
+    aoi_path.write_text(
+        f'<osm version="0.6">{nodes}'
+        '<way id="10" version="1"><nd ref="1"/><nd ref="2"/></way>'
+        '<way id="11" version="1"><nd ref="3"/><nd ref="4"/></way>'
+        '<way id="12" version="1"><nd ref="5"/><nd ref="6"/></way>'
+        '<way id="13" version="1"><nd ref="7"/><nd ref="8"/></way>'
+        '<relation id="20" version="1"><member type="node" ref="1" role=""/>'
+        '<member type="way" ref="13" role=""/></relation>'
+        '<relation id="21" version="1"><member type="way" ref="12" role=""/></relation>'
+        '</osm>'
+    )
+    tracker = OSMElementsTracker()
+    tracker.referenced_elements['nodes'].add(1)
+    tracker.modified_elements['nodes'].add(1)
+    tracker.referenced_elements['ways'].add(11)
+    tracker.modified_elements['ways'].add(11)
+
+    handler = AOIHandler(tracker, str(tmp_path / 'referenced.osm'), location_index)
+    handler.apply_file_and_cleanup(str(aoi_path))
+
+    assert (handler.nodes_count, handler.ways_count, handler.relations_count) == (8, 4, 2)
+    assert set(handler.nodes) == {1}
+    assert set(handler.ways) == {11}
+    assert set(handler.referring_ways) == {10}
+    assert set(handler.referring_relations) == {20}
+    assert handler.referring_ways[10]['nodes'] == [{'ref': 1}, {'ref': 2}]
+    assert dict(handler.nodes_references_by_ways.items()) == {1: [10]}
+    assert dict(handler.nodes_references_by_relations.items()) == {1: [20]}
+
+    written = VersionHandler()
+    written.apply_file(handler.ref_osm_path)
+    assert set(written.nodes_versions) == {1, 2, 3, 4}
+    # Untracked nodes are written with just their location, unless they are tagged
+    assert dict(written.nodes_versions.items())[4] == 3
+    assert dict(written.nodes_versions.items())[3] == 0
+    assert set(written.ways_versions) == {10, 11}
+    assert set(written.relations_versions) == {20}
+    assert not os.path.exists(handler.locations_path)
+
+
+def test_scan_aoi_file_result_can_be_pickled(tmp_path):
+    aoi_path = tmp_path / 'aoi.osm'
+    aoi_path.write_text(
+        '<osm version="0.6"><node id="1" version="3" lat="1" lon="1"/><node id="2" version="1" lat="1" lon="1"/>'
+        '<way id="10" version="2"><nd ref="1"/><nd ref="2"/></way></osm>'
+    )
+    tracker = OSMElementsTracker()
+    tracker.referenced_elements['nodes'].add(1)
+
+    result = pickle.loads(pickle.dumps(
+        scan_aoi_file(tracker, str(aoi_path), str(tmp_path / 'referenced.osm'), collect_versions=True)
+    ))
+    # Versions are kept only for the tracked elements
+    assert dict(result.nodes_versions.items()) == {1: 3}
+    assert len(result.ways_versions) == 0
+    assert set(result.referring_ways) == {10}
+    assert result.nodes_references_by_ways.referrers_of(1) == [10]
+
+
+def test_missing_local_elements_are_read_from_changesets():
+    tracker = OSMElementsTracker()
+    changesets = [
+        '<osmChange version="0.6"><create><node id="1" version="1" lat="1" lon="1"/></create>'
+        '<modify><node id="2" version="2" lat="1" lon="1"/></modify></osmChange>',
+        '<osmChange version="0.6"><modify><node id="2" version="3" lat="2" lon="2"/></modify></osmChange>',
+    ]
+    for changeset in changesets:
+        ElementsFilterHandler(tracker).apply_buffer(changeset.encode('utf-8'), 'osc')
+
+    # Local extract without node 2
+    local_aoi = ElementsFilterHandler(OSMElementsTracker())
+    local_aoi.nodes[1] = {'id': 1}
+    missing = tracker.get_missing_elements(local_aoi)
+    assert missing == {'nodes': {2}, 'ways': set(), 'relations': set()}
+    assert tracker.get_modified_elements(local_aoi)['nodes'] == []
+
+    handler = ChangesetElementsHandler(missing)
+    for changeset in changesets:
+        handler.apply_buffer(changeset.encode('utf-8'), 'osc')
+    assert set(handler.nodes) == {2}
+    assert handler.nodes[2]['version'] == 3
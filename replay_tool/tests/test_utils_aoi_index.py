@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from replay_tool.utils import aoi_index
+from replay_tool.utils.aoi_index import read_index_meta, scan_aoi_index
+from replay_tool.utils.osmium_handlers import OSMElementsTracker, VersionHandler, scan_aoi_file
+
+
+NODES_XML = ''.join(
+    f'<node id="{i}" version="{i}" lat="1.{i}" lon="2.{i}" user="u" uid="1" changeset="1" '
+    'timestamp="2020-01-01T00:00:00Z"><tag k="a" v="b"/></node>' for i in range(1, 9)
+)
+AOI_XML = (
+    f'<osm version="0.6">{NODES_XML}'
+    '<way id="10" version="1"><nd ref="1"/><nd ref="2"/><nd ref="1"/></way>'
+    '<way id="11" version="2"><nd ref="3"/><nd ref="4"/><tag k="highway" v="road"/></way>'
+    '<way id="12" version="1"><nd ref="5"/><nd ref="6"/></way>'
+    '<way id="13" version="1"><nd ref="7"/><nd ref="8"/></way>'
+    '<relation id="20" version="1"><member type="node" ref="1" role="label"/>'
+    '<member type="way" ref="13" role=""/></relation>'
+    '<relation id="21" version="3"><member type="way" ref="12" role=""/></relation>'
+    '</osm>'
+)
+
+
+def read_versions(path):
+    handler = VersionHandler()
+    handler.apply_file(path)
+    return handler.nodes_versions, handler.ways_versions, handler.relations_versions
+
+
+def test_aoi_index_scan_matches_file_scan(tmp_path, monkeypatch):
+    aoi_path = tmp_path / 'aoi.osm'
+    aoi_path.write_text(AOI_XML)
+    tracker = OSMElementsTracker()
+    for etype, eid in [('nodes', 1), ('nodes', 3), ('ways', 11), ('relations', 21)]:
+        tracker.referenced_elements[etype].add(eid)
+        tracker.modified_elements[etype].add(eid)
+    tracker.added_elements['nodes'].add(100)
+
+    scanned = scan_aoi_file(tracker, str(aoi_path), str(tmp_path / 'scanned.osm'), collect_versions=True)
+    index_path = str(tmp_path / 'aoi.sqlite')
+    indexed = scan_aoi_index(tracker, str(aoi_path), index_path, str(tmp_path / 'indexed.osm'), collect_versions=True)
+
+    for field in ('nodes_count', 'ways_count', 'relations_count', 'nodes', 'ways', 'relations',
+                  'referring_ways', 'referring_relations'):
+        assert getattr(indexed, field) == getattr(scanned, field), field
+    for field in ('nodes_references_by_ways', 'nodes_references_by_relations',
+                  'nodes_versions', 'ways_versions', 'relations_versions'):
+        assert list(getattr(indexed, field).items()) == list(getattr(scanned, field).items()), field
+    assert read_versions(indexed.ref_osm_path) == read_versions(scanned.ref_osm_path)
+    assert read_versions(indexed.nodes_ref_osm_path) == read_versions(scanned.nodes_ref_osm_path)
+
+    # The index is built again only when the file changes, the file is hashed only when its stat changes
+    sha256 = read_index_meta(index_path)['sha256']
+    with monkeypatch.context() as m:
+        m.setattr(aoi_index, 'get_file_sha256', None)
+        scan_aoi_index(tracker, str(aoi_path), index_path, str(tmp_path / 'indexed.osm'))
+    os.utime(str(aoi_path), ns=(0, 0))
+    scan_aoi_index(tracker, str(aoi_path), index_path, str(tmp_path / 'indexed.osm'))
+    assert read_index_meta(index_path)['sha256'] == sha256
+    assert read_index_meta(index_path)['mtime_ns'] == '0'
+    aoi_path.write_text(AOI_XML.replace('version="3"', 'version="4"'))
+    result = scan_aoi_index(tracker, str(aoi_path), index_path, str(tmp_path / 'indexed.osm'), collect_versions=True)
+    assert read_index_meta(index_path)['sha256'] != sha256
+    assert result.relations_versions[21] == 4
+
+
+def test_tracked_node_without_location_fails_both_scans(tmp_path):
+    aoi_path = tmp_path / 'aoi.osm'
+    aoi_path.write_text('<osm version="0.6"><node id="1" version="1"/><node id="2" version="1"/></osm>')
+    tracker = OSMElementsTracker()
+    tracker.referenced_elements['nodes'].add(1)
+    tracker.modified_elements['nodes'].add(1)
+
+    with pytest.raises(Exception, match='Tracked node 1 has no location'):
+        scan_aoi_file(tracker, str(aoi_path), str(tmp_path / 'scanned.osm'))
+    with pytest.raises(Exception, match='Tracked node 1 has no location'):
+        scan_aoi_index(tracker, str(aoi_path), str(tmp_path / 'aoi.sqlite'), str(tmp_path / 'indexed.osm'))
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from replay_tool.utils.apidb import OSMChangeBuilder
+from replay_tool.utils.osmium_handlers import OSMElementsTracker, ElementsFilterHandler
+
+
+def test_osmchange_builder_output_is_tracked():
+    ts = datetime(2020, 1, 1)
+    builder = OSMChangeBuilder('mapper', 7)
+    builder.add_node((10, 1, 1, True, ts, 277000000, 853000000, [['name', 'a']]))
+    builder.add_node((10, 2, 3, True, ts, 277000001, 853000001, []))
+    builder.add_node((10, 3, 2, False, ts, None, None, []))
+    builder.add_way((10, 5, 2, True, ts, [['highway', 'path']], [1, 2]))
+    builder.add_relation((10, 6, 4, True, ts, [], [['way', '5', 'outer']]))
+
+    tracker = OSMElementsTracker()
+    ElementsFilterHandler(tracker).apply_buffer(builder.get_xml().encode('utf-8'), 'osc')
+
+    assert tracker.added_elements['nodes'] == {1}
+    assert tracker.modified_elements['nodes'] == {2}
+    assert tracker.deleted_elements['nodes'] == {3}
+    assert tracker.modified_elements['ways'] == {5}
+    assert tracker.modified_elements['relations'] == {6}
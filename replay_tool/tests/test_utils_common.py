@@ -1 +1,42 @@
-from replay_tool.utils.common import filter_elements_from_aoi_handler
+from replay_tool.utils.common import (
+    filter_elements_from_aoi_handler,
+    get_overpass_elements_query,
+    get_overpass_elements_queries,
+    get_pushed_changeset_ids,
+)
+from replay_tool.utils.compression import compress_text
+
+
+def test_get_overpass_elements_query():
+    # Relations referring to the ways and relations are fetched as well as the ones referring to the nodes
+    query = get_overpass_elements_query({'nodes': [1], 'ways': [7], 'relations': [9, 8]})
+    assert query == (
+        '(node(id:1);way(id:7);rel(id:9,8););'
+        '(._;way(bn);rel(bn);rel(bw);rel(br););(._;>;);out meta;'
+    )
+
+
+def test_get_overpass_elements_queries():
+    queries = get_overpass_elements_queries({'nodes': {3, 1}, 'ways': {7}, 'relations': set()}, 2)
+    assert queries == [
+        '(node(id:1,3););(._;way(bn);rel(bn);rel(bw);rel(br););(._;>;);out meta;',
+        '(way(id:7););(._;way(bn);rel(bn);rel(bw);rel(br););(._;>;);out meta;',
+    ]
+    assert get_overpass_elements_queries({'nodes': set(), 'ways': set(), 'relations': set()}, 2) == []
+
+
+def test_get_pushed_changeset_ids():
+    changesets = [
+        (1, compress_text(
+            '<osmChange version="0.6"><create><node id="10" version="1" lat="1" lon="1"/></create></osmChange>'
+        )),
+        (2, compress_text(
+            '<osmChange version="0.6"><modify><way id="20" version="2"><nd ref="10"/></way></modify></osmChange>'
+        )),
+    ]
+    # Every element is pushed
+    not_pushed = {'nodes': set(), 'ways': set(), 'relations': set()}
+    assert get_pushed_changeset_ids(changesets, not_pushed) == [1, 2]
+    # The way is unresolved, its changeset is left to be tracked again
+    not_pushed['ways'].add(20)
+    assert get_pushed_changeset_ids(changesets, not_pushed) == [1]
@@ -0,0 +1,43 @@
+import json
+
+import osmium
+
+from replay_tool.serializers.osm import NodeSerializer, WaySerializer, RelationSerializer
+from replay_tool.utils.element_records import node_to_dict, way_to_dict, relation_to_dict
+
+
+class RecordsHandler(osmium.SimpleHandler):
+    def __init__(self):
+        super().__init__()
+        self.pairs = []
+
+    def node(self, n):
+        self.pairs.append((NodeSerializer(n).data, node_to_dict(n)))
+
+    def way(self, w):
+        self.pairs.append((WaySerializer(w).data, way_to_dict(w)))
+
+    def relation(self, r):
+        self.pairs.append((RelationSerializer(r).data, relation_to_dict(r)))
+
+
+def test_element_records_match_serializers(tmp_path):
+    osm_path = tmp_path / 'data.osm'
+    osm_path.write_text(
+        '<osm version="0.6">'
+        '<node id="1" version="2" lat="27.7" lon="85.3" '
+        'user="u" uid="5" changeset="9" timestamp="2020-01-01T00:00:00Z">'
+        '<tag k="name" v="Kathmandu"/><tag k="place" v="city"/></node>'
+        '<node id="2" version="1" lat="-1.5" lon="0"/>'
+        '<way id="10" version="1" user="u" uid="5" changeset="9" timestamp="2020-01-01T00:00:00Z">'
+        '<nd ref="1"/><nd ref="2"/><tag k="highway" v="road"/></way>'
+        '<relation id="20" version="3"><member type="node" ref="1" role="label"/>'
+        '<member type="way" ref="10" role=""/><member type="relation" ref="21" role="sub"/></relation>'
+        '</osm>'
+    )
+    handler = RecordsHandler()
+    handler.apply_file(str(osm_path))
+    assert handler.pairs
+    for serialized, record in handler.pairs:
+        # Same json is stored, including the order of keys
+        assert json.dumps(record) == json.dumps(serialized)
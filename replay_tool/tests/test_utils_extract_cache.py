@@ -0,0 +1,51 @@
+import os
+
+from datetime import datetime, timedelta, timezone
+
+from replay_tool.utils.extract_cache import ExtractCache, OSM_BASE_FORMAT
+
+
+def osm_base(**delta) -> str:
+    return (datetime.now(timezone.utc) - timedelta(**delta)).strftime(OSM_BASE_FORMAT)
+
+
+def test_extract_cache(tmp_path):
+    cache = ExtractCache(str(tmp_path / 'cache'), max_age_secs=600, max_size_bytes=100)
+    src = tmp_path / 'extract.osm'
+    src.write_text('<osm/>')
+    dest = str(tmp_path / 'current.osm')
+
+    key = cache.get_key('url', 'query')
+    assert cache.get(key, dest) is None
+
+    # Stale data is not used
+    cache.put(key, str(src), osm_base(hours=1))
+    assert cache.get(key, dest) is None
+
+    # Data from the future, like a planted file, is not used
+    cache.put(key, str(src), osm_base(hours=-1))
+    assert cache.get(key, dest) is None
+
+    fresh = osm_base(minutes=1)
+    cache.put(key, str(src), fresh)
+    assert cache.get(key, dest) == fresh
+    assert open(dest).read() == '<osm/>'
+    # Data without timestamp is not cached
+    cache.put(cache.get_key('url', 'other'), str(src), None)
+    assert len(os.listdir(cache.cache_dir)) == 3
+
+
+def test_extract_cache_evicts_least_recently_used(tmp_path):
+    cache = ExtractCache(str(tmp_path / 'cache'), max_age_secs=600, max_size_bytes=12)
+    first, second, third = [cache.get_key(x) for x in 'abc']
+    for key in (first, second, third):
+        # Separate files, as cached entries are hard links of the sources
+        src = tmp_path / f'{key}.osm'
+        src.write_text('<osm/>')
+        cache.put(key, str(src), osm_base(minutes=1))
+        if key == second:
+            # second is made the least recently used, so it is evicted
+            os.utime(cache.lookup(second)[0], (0, 0))
+    assert cache.lookup(first) is not None
+    assert cache.lookup(second) is None
+    assert cache.lookup(third) is not None
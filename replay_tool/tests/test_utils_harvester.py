@@ -0,0 +1,30 @@
+import pytest
+
+from replay_tool.utils.harvester import ChangesetHarvester
+
+
+def test_harvester_keeps_order_and_stops_at_missing():
+    existing_ids = {3, 4, 6, 9, 15}
+
+    def fetch_meta(cid):
+        return f'meta {cid}' if cid in existing_ids else None
+
+    def fetch_data(cid):
+        return f'data {cid}'
+
+    harvester = ChangesetHarvester(fetch_meta, fetch_data, workers=2)
+    harvested = [x for batch in harvester.harvest([3, 4, 6, 9, 15]) for x in batch]
+    assert [x[0] for x in harvested] == [3, 4, 6, 9, 15]
+    assert harvested[0] == (3, 'meta 3', 'data 3')
+
+    # Changesets after a missing one are not harvested, so the last one saved never skips over it
+    harvested = []
+    with pytest.raises(Exception):
+        for batch in harvester.harvest([3, 4, 5, 6]):
+            harvested.extend(batch)
+    assert [x[0] for x in harvested] == [3, 4]
+
+
+def test_harvester_without_changesets():
+    harvester = ChangesetHarvester(lambda cid: None, lambda cid: '', workers=1)
+    assert list(harvester.harvest([])) == []
@@ -0,0 +1,68 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from replay_tool.utils import http
+from replay_tool.utils.http import HTTPClient, get_http_client
+
+
+@pytest.fixture
+def server():
+    """Local server which answers with the queued status codes, 200 once they run out"""
+    statuses = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(statuses.pop(0) if statuses else 200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, *args):
+            pass
+
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/', statuses
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_client_retries(server):
+    url, statuses = server
+    client = HTTPClient(retries=2, backoff_factor=0)
+
+    statuses.extend([503, 502])
+    assert client.get(url).status_code == 200
+    assert statuses == []
+
+    # The last response is returned once the retries run out
+    statuses.extend([503, 503, 503, 200])
+    assert client.get(url).status_code == 503
+    assert statuses == [200]
+
+    # Client errors are not retried
+    statuses[:] = [404, 200]
+    assert client.get(url).status_code == 404
+
+
+def test_http_client_latency_stats_reset_when_logged(server):
+    url, _ = server
+    client = HTTPClient(retries=0)
+    client.get(url)
+    client.get(url)
+    [stats] = client.get_latency_stats().values()
+    assert stats['count'] == 2
+
+    client.log_latency_stats()
+    assert client.get_latency_stats() == {}
+
+
+def test_get_http_client_per_process(monkeypatch):
+    client = get_http_client()
+    assert get_http_client() is client
+    # Forked workers get a client of their own
+    monkeypatch.setattr(http.os, 'getpid', lambda: -1)
+    assert get_http_client() is not client
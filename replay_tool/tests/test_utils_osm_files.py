@@ -0,0 +1,26 @@
+from replay_tool.utils.compression import compress_text, GZIPPED_OSM_CHANGE_FORMAT
+from replay_tool.utils.osm_files import apply_osm_change_buffers
+from replay_tool.utils.osmium_handlers import VersionHandler
+
+
+def test_apply_osm_change_buffers(tmp_path):
+    original_path = tmp_path / 'original.osm'
+    original_path.write_text(
+        '<osm version="0.6"><node id="1" version="1" lat="1" lon="1"/><node id="2" version="1" lat="1" lon="1"/>'
+        '<way id="5" version="1"><nd ref="1"/><nd ref="2"/></way></osm>'
+    )
+    changesets = [
+        '<osmChange version="0.6"><create><node id="3" version="1" lat="2" lon="2"/></create>'
+        '<modify><way id="5" version="2"><nd ref="1"/><nd ref="3"/></way></modify></osmChange>',
+        '<osmChange version="0.6"><delete><node id="2" version="2"/></delete>'
+        '<modify><way id="5" version="3"><nd ref="1"/></way></modify></osmChange>',
+    ]
+    local_path = str(tmp_path / 'local.osm.pbf')
+    apply_osm_change_buffers(
+        str(original_path), (compress_text(x) for x in changesets), GZIPPED_OSM_CHANGE_FORMAT, local_path,
+    )
+
+    handler = VersionHandler()
+    handler.apply_file(local_path)
+    assert handler.nodes_versions == {1: 1, 3: 1}
+    assert handler.ways_versions == {5: 3}
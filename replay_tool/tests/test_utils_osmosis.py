@@ -0,0 +1,87 @@
+import os
+import subprocess
+import time
+import threading
+
+import pytest
+
+from replay_tool.utils.osmosis import (
+    cleanup_job,
+    read_job_status,
+    run_osmosis_job,
+    submit_job,
+    JOB_AUTH_EXT,
+    JOB_COMMAND_EXT,
+    JOB_DEADLINE_EXT,
+    JOB_RUNNING_EXT,
+    JOB_STATUS_EXT,
+)
+
+
+def run_jobs(jobs_dir, status, seen_files=None):
+    """Stands in for scripts/pipe_reader_writer.sh, finishes the first submitted job with the status"""
+    while True:
+        jobs = [x for x in os.listdir(jobs_dir) if x.endswith(JOB_COMMAND_EXT)]
+        if jobs:
+            break
+    job = os.path.join(jobs_dir, jobs[0][:-len(JOB_COMMAND_EXT)])
+    if seen_files is not None:
+        seen_files.update({x: os.stat(os.path.join(jobs_dir, x)).st_mode & 0o777 for x in os.listdir(jobs_dir)})
+    os.rename(job + JOB_COMMAND_EXT, job + JOB_RUNNING_EXT)
+    with open(job + JOB_STATUS_EXT, 'w') as f:
+        f.write(status)
+
+
+def test_run_osmosis_job(tmp_path):
+    jobs_dir = str(tmp_path)
+    runner = threading.Thread(target=run_jobs, args=(jobs_dir, '0\nno errors reported\n'))
+    runner.start()
+    run_osmosis_job(jobs_dir, 'osmosis', deadline_secs=5, poll_interval_secs=0.01)
+    runner.join()
+    # Job files are cleaned up
+    assert os.listdir(jobs_dir) == []
+
+    # Credentials are only in the auth file, which only the owner can read, and it is removed on failures too
+    seen_files = {}
+    runner = threading.Thread(target=run_jobs, args=(jobs_dir, '1\nconnection refused\n', seen_files))
+    runner.start()
+    with pytest.raises(Exception, match='exit code 1: connection refused'):
+        run_osmosis_job(
+            jobs_dir, 'osmosis authFile="$JOB_AUTH_FILE"', deadline_secs=5, poll_interval_secs=0.01,
+            auth={'host': 'localhost', 'user': 'posm', 'password': 'secret'},
+        )
+    runner.join()
+    assert sorted(os.path.splitext(x)[1] for x in seen_files) == [JOB_AUTH_EXT, JOB_COMMAND_EXT, JOB_DEADLINE_EXT]
+    assert set(seen_files.values()) == {0o600}
+    assert os.listdir(jobs_dir) == []
+
+
+def test_run_osmosis_job_not_picked_up(tmp_path):
+    with pytest.raises(Exception, match='not picked up'):
+        run_osmosis_job(str(tmp_path), 'osmosis', deadline_secs=5, pickup_timeout_secs=0.05, poll_interval_secs=0.01)
+    # The job won't run later
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_job_runner_kills_jobs(tmp_path):
+    jobs_dir = str(tmp_path)
+    runner = subprocess.Popen(
+        ['bash', 'scripts/pipe_reader_writer.sh'],
+        env={**os.environ, 'OSMOSIS_HOST_JOBS_DIR': jobs_dir, 'OSMOSIS_JOBS_POLL_INTERVAL_SECS': '0.05'},
+    )
+    try:
+        # Killed by the runner after its deadline, even if the app still waits
+        job_id = submit_job(jobs_dir, 'sleep 5', deadline_secs=0.5)
+        while not os.path.exists(os.path.join(jobs_dir, job_id + JOB_STATUS_EXT)):
+            time.sleep(0.01)
+        assert read_job_status(jobs_dir, job_id) == (124, 'Job killed after the deadline of 0.5 seconds')
+        cleanup_job(jobs_dir, job_id)
+        # Killed once the app withdraws it, the runner removes the error output only after the job ends
+        job_id = submit_job(jobs_dir, 'sleep 5')
+        while not os.path.exists(os.path.join(jobs_dir, job_id + JOB_RUNNING_EXT)):
+            time.sleep(0.01)
+        cleanup_job(jobs_dir, job_id)
+        time.sleep(0.5)
+        assert os.listdir(jobs_dir) == []
+    finally:
+        runner.kill()
@@ -0,0 +1,101 @@
+import pytest
+import requests
+
+from replay_tool.utils import overpass
+
+from replay_tool.utils.osm_files import apply_osm_changes
+from replay_tool.utils.osmium_handlers import VersionHandler
+from replay_tool.utils.overpass import (
+    validate_osm_file,
+    download_overpass_query,
+    get_tile_bboxes,
+    adiff_to_osmchange,
+    OverpassTimeoutError,
+)
+
+
+def write(tmp_path, content):
+    path = tmp_path / 'aoi.osm'
+    path.write_text(content)
+    return str(path)
+
+
+def test_validate_osm_file(tmp_path):
+    validate_osm_file(write(tmp_path, '<?xml version="1.0"?><osm version="0.6"><node id="1"/></osm>'))
+
+    with pytest.raises(OverpassTimeoutError):
+        validate_osm_file(write(
+            tmp_path,
+            '<osm version="0.6"><node id="1"/>'
+            '<remark> runtime error: Query timed out in "query" at line 1 after 180 seconds. </remark></osm>',
+        ))
+
+    with pytest.raises(Exception, match='not osm data'):
+        validate_osm_file(write(tmp_path, '<html><body>Too many requests</body></html>'))
+
+    with pytest.raises(Exception, match='incomplete'):
+        validate_osm_file(write(tmp_path, '<osm version="0.6"><node id="1"/>'))
+
+
+def test_get_tile_bboxes():
+    tiles = get_tile_bboxes([85.0, 27.0, 85.25, 27.1], 0.1)
+    assert len(tiles) == 3
+    assert tiles[0][:2] == [85.0, 27.0]
+    assert tiles[-1][2:] == [85.25, 27.1]
+    # Tiles share edges, without gaps
+    assert tiles[0][2] == tiles[1][0]
+
+    assert get_tile_bboxes([85.0, 27.0, 85.01, 27.01], 0.1) == [[85.0, 27.0, 85.01, 27.01]]
+
+
+def test_adiff_to_osmchange(tmp_path):
+    adiff_path = write(tmp_path, '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+  <meta osm_base="2020-02-01T00:00:00Z"/>
+  <action type="create"><node id="9" version="1" lat="1" lon="1"/></action>
+  <action type="modify">
+    <old><node id="2" version="1" lat="1" lon="1"/></old>
+    <new><node id="2" version="2" lat="2" lon="2"/></new>
+  </action>
+  <action type="delete">
+    <old><node id="3" version="1" lat="1" lon="1"/></old>
+    <new><node id="3" version="2" visible="false"/></new>
+  </action>
+  <action type="delete">
+    <old><way id="5" version="1"><nd ref="1"/></way></old>
+    <new><way id="5" version="2"><nd ref="8"/></way></new>
+  </action>
+</osm>''')
+    assert validate_osm_file(adiff_path) == '2020-02-01T00:00:00Z'
+
+    osc_path = str(tmp_path / 'changes.osc')
+    assert adiff_to_osmchange(adiff_path, osc_path) == 4
+    base_path = tmp_path / 'base.osm'
+    base_path.write_text(
+        '<osm version="0.6"><node id="1" version="1" lat="1" lon="1"/><node id="2" version="1" lat="1" lon="1"/>'
+        '<node id="3" version="1" lat="1" lon="1"/><way id="5" version="1"><nd ref="1"/></way></osm>'
+    )
+    output_path = str(tmp_path / 'output.osm')
+    apply_osm_changes(str(base_path), [osc_path], output_path)
+
+    handler = VersionHandler()
+    handler.apply_file(output_path)
+    assert handler.nodes_versions == {1: 1, 2: 2, 9: 1}
+    # Way which left the bbox is still upstream
+    assert handler.ways_versions == {5: 2}
+
+
+def test_download_overpass_query_retries_cut_off_response(tmp_path, monkeypatch):
+    attempts = []
+
+    def stream_to_file(url, query, path):
+        attempts.append(path)
+        if len(attempts) == 1:
+            raise requests.exceptions.ChunkedEncodingError('Connection broken')
+        with open(path, 'w') as f:
+            f.write('<?xml version="1.0"?><osm version="0.6"><meta osm_base="2020-01-01T00:00:00Z"/></osm>')
+
+    monkeypatch.setattr(overpass, 'stream_to_file', stream_to_file)
+    path = str(tmp_path / 'aoi.osm')
+    assert download_overpass_query('http://overpass', 'query', path, backoff_secs=0) == '2020-01-01T00:00:00Z'
+    assert len(attempts) == 2
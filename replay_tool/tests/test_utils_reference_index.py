@@ -0,0 +1,28 @@
+import pytest
+
+from replay_tool.utils.reference_index import ReverseReferenceIndex
+
+
+def test_reverse_reference_index():
+    index = ReverseReferenceIndex()
+    for node_id, way_id in [(5, 100), (2, 101), (5, 99), (7, 100), (2, 100)]:
+        index.add(node_id, way_id)
+
+    # Referrers in the order they were added
+    assert index.referrers_of(5) == [100, 99]
+    assert index.referrers_of(2) == [101, 100]
+    assert index.referrers_of(3) == []
+    assert index.get(3) is None
+    assert 7 in index and 8 not in index
+    assert len(index) == 3
+    assert list(index.items()) == [(2, [101, 100]), (5, [100, 99]), (7, [100])]
+    assert index.referrer_ids() == {99, 100, 101}
+
+    with pytest.raises(Exception):
+        index.add(1, 1)
+
+
+def test_empty_reverse_reference_index():
+    index = ReverseReferenceIndex()
+    assert index.referrers_of(1) == []
+    assert list(index.items()) == []
@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+
+from replay_tool.utils.transformations import parse_changeset_meta
+
+
+def test_parse_changeset_meta():
+    meta = parse_changeset_meta(
+        '<osm version="0.6"><changeset id="10" created_at="2020-01-02T03:04:05Z" open="false" user="mapper" '
+        'uid="2" min_lat="27.67" min_lon="85.31" max_lat="27.68" max_lon="85.32" changes_count="4">'
+        '<tag k="comment" v="fix"/></changeset></osm>'
+    )
+    assert meta == {
+        'created_at': datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        'num_changes': 4,
+        'user': 'mapper',
+        'min_lat': 27.67,
+        'min_lon': 85.31,
+        'max_lat': 27.68,
+        'max_lon': 85.32,
+    }
+
+
+def test_parse_changeset_meta_without_bounds():
+    meta = parse_changeset_meta('<osm><changeset id="11" created_at="2020-01-02T03:04:05Z" user="m"/></osm>')
+    assert meta['min_lat'] is None and meta['max_lon'] is None
+    assert meta['num_changes'] is None
@@ -0,0 +1,19 @@
+from replay_tool.utils.version_index import VersionIndex
+
+
+def test_version_index_filters_newer_elements():
+    index = VersionIndex()
+    for eid, version in [(5, 2), (1, 3), (9, 1)]:
+        index.add(eid, version)
+    assert index[1] == 3 and index.get(2) is None and 9 in index
+    assert list(index.items()) == [(1, 3), (5, 2), (9, 1)]
+
+    elements = {
+        9: {'id': 9, 'version': 1},
+        1: {'id': 1, 'version': 4},
+        5: {'id': 5, 'version': 2},
+        # Deleted upstream and not in the original aoi
+        7: {'id': 7, 'deleted': True},
+        11: {'id': 11, 'version': 1},
+    }
+    assert set(index.filter_newer(elements)) == {1, 7, 11}
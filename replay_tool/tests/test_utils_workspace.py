@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+from replay_tool.utils.workspace import (
+    CHECKPOINT_FILE_NAME,
+    create_run_workspace,
+    save_checkpoint,
+    load_checkpoint,
+    read_checkpoint_info,
+)
+
+
+def test_checkpoint_is_loaded_only_for_its_stage_and_info(tmp_path):
+    workspace_dir = str(tmp_path)
+    run_dir = create_run_workspace(workspace_dir, keep_runs=1)
+    save_checkpoint(workspace_dir, run_dir, 'detecting_conflicts', {'ids': {1, 2}}, aoi_name='aoi')
+
+    assert load_checkpoint(workspace_dir, 'detecting_conflicts', aoi_name='aoi') == {'ids': {1, 2}}
+    with pytest.raises(Exception):
+        load_checkpoint(workspace_dir, 'detecting_conflicts', aoi_name='other_aoi')
+    with pytest.raises(Exception):
+        load_checkpoint(workspace_dir, 'creating_geojsons', aoi_name='aoi')
+
+    # Old runs are removed, except for the one of the latest checkpoint
+    new_runs = [create_run_workspace(workspace_dir, keep_runs=1) for _ in range(2)]
+    assert os.path.exists(run_dir)
+    assert not os.path.exists(new_runs[0]) and os.path.exists(new_runs[1])
+    assert load_checkpoint(workspace_dir, 'detecting_conflicts', aoi_name='aoi') == {'ids': {1, 2}}
+
+
+def test_checkpoint_data_outside_of_runs_is_not_loaded(tmp_path):
+    workspace_dir = str(tmp_path / 'workspace')
+    run_dir = create_run_workspace(workspace_dir, keep_runs=1)
+    save_checkpoint(workspace_dir, run_dir, 'detecting_conflicts', {'ids': {1, 2}}, aoi_name='aoi')
+    assert os.stat(workspace_dir).st_mode & 0o777 == 0o700
+
+    checkpoint = read_checkpoint_info(workspace_dir)
+    outside_path = str(tmp_path / 'outside.pickle')
+    os.rename(checkpoint['data_path'], outside_path)
+    with open(os.path.join(workspace_dir, CHECKPOINT_FILE_NAME), 'w') as f:
+        json.dump({**checkpoint, 'data_path': outside_path}, f)
+    with pytest.raises(Exception, match='not inside a run'):
+        load_checkpoint(workspace_dir, 'detecting_conflicts', aoi_name='aoi')
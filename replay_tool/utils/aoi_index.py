@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import osmium
+from django.utils.dateparse import parse_datetime
+
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from .element_records import node_to_dict, way_to_dict, relation_to_dict
+from .osmium_handlers import AOIScanResult, write_referenced_elements
+from .reference_index import ReverseReferenceIndex
+from .version_index import VersionIndex
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Element types as stored in the index, by the element types of the tracker
+INDEX_TYPES = {'nodes': 'n', 'ways': 'w', 'relations': 'r'}
+INDEX_INSERT_BATCH_SIZE = 10000
+HASH_CHUNK_BYTES = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE elements (
+    type TEXT, id INTEGER, version INTEGER, lon REAL, lat REAL, record TEXT,
+    PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+CREATE TABLE node_refs (node_id INTEGER, referrer_type TEXT, referrer_id INTEGER);
+'''
+
+
+def get_file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class AOIIndexBuilder(osmium.SimpleHandler):
+    """
+    Stores every element of an osm file in the sqlite index: its version, its record as stored in
+    OSMElement data, location of nodes and the ways and relations referring to each node.
+    """
+    def __init__(self, conn: sqlite3.Connection):
+        super().__init__()
+        self.conn = conn
+        self.counts = {'nodes': 0, 'ways': 0, 'relations': 0}
+        self._elements: List[tuple] = []
+        self._node_refs: List[tuple] = []
+
+    def add_element(self, etype, o, record, lon=None, lat=None):
+        self.counts[etype] += 1
+        record_json = json.dumps(record, separators=(',', ':')) if record is not None else None
+        self._elements.append((INDEX_TYPES[etype], o.id, o.version, lon, lat, record_json))
+        if len(self._elements) >= INDEX_INSERT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany('INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?)', self._elements)
+        self.conn.executemany('INSERT INTO node_refs VALUES (?, ?, ?)', self._node_refs)
+        self._elements = []
+        self._node_refs = []
+
+    def node(self, n):
+        if n.location.valid():
+            self.add_element('nodes', n, node_to_dict(n), n.location.lon, n.location.lat)
+        else:
+            # Only an error if the node is tracked, as when scanning the file with AOIHandler
+            self.add_element('nodes', n, None)
+
+    def way(self, w):
+        self._node_refs.extend((x.ref, 'w', w.id) for x in w.nodes)
+        self.add_element('ways', w, way_to_dict(w))
+
+    def relation(self, r):
+        self._node_refs.extend((m.ref, 'r', r.id) for m in r.members if m.type == 'n')
+        self.add_element('relations', r, relation_to_dict(r))
+
+
+def get_file_stat_meta(path: str) -> Dict[str, str]:
+    stat = os.stat(path)
+    return {'size': str(stat.st_size), 'mtime_ns': str(stat.st_mtime_ns)}
+
+
+def build_aoi_index(osm_path: str, index_path: str, sha256: str) -> None:
+    """Indexes the osm file into a new sqlite file at index_path"""
+    part_path = index_path + '.part'
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    conn = sqlite3.connect(part_path)
+    try:
+        # Nothing to recover from if the build is interrupted, the file is built again
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript(SCHEMA)
+        builder = AOIIndexBuilder(conn)
+        builder.apply_file(osm_path)
+        builder.flush()
+        conn.execute('CREATE INDEX node_refs_node_id ON node_refs (node_id, referrer_id)')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('sha256', sha256),
+            *get_file_stat_meta(osm_path).items(),
+            *((f'{etype}_count', str(count)) for etype, count in builder.counts.items()),
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(part_path, index_path)
+
+
+def read_index_meta(index_path: str) -> Dict[str, str]:
+    try:
+        conn = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True)
+    except sqlite3.Error:
+        return {}
+    try:
+        return dict(conn.execute('SELECT key, value FROM meta'))
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+
+
+def ensure_aoi_index(osm_path: str, index_path: str) -> None:
+    """
+    Builds the index of the osm file, unless there is one already for a file with the same hash.
+    The file is hashed only if its size or modification time differ from the ones of the indexed file.
+    """
+    meta = read_index_meta(index_path) if os.path.exists(index_path) else {}
+    stat_meta = get_file_stat_meta(osm_path)
+    if meta and all(meta.get(key) == value for key, value in stat_meta.items()):
+        return
+    sha256 = get_file_sha256(osm_path)
+    if meta.get('sha256') == sha256:
+        # Same file, touched or copied, its new stat is recorded so that it is not hashed again
+        conn = sqlite3.connect(index_path)
+        try:
+            conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', stat_meta.items())
+            conn.commit()
+        finally:
+            conn.close()
+        return
+    logger.info(f'Indexing {osm_path} into {index_path}')
+    build_aoi_index(osm_path, index_path, sha256)
+
+
+def record_to_common_attrs(record: dict) -> dict:
+    return {
+        'id': record['id'],
+        'version': record['version'],
+        'visible': record['visible'],
+        'changeset': record['changeset'],
+        'timestamp': parse_datetime(record['timestamp']),
+        'uid': record['uid'],
+        'tags': [(t['k'], t['v']) for t in record['tags']],
+    }
+
+
+def record_to_node(record: dict, location) -> osmium.osm.mutable.Node:
+    node = osmium.osm.mutable.Node(location=location, **record_to_common_attrs(record))
+    node.user = record['user']
+    return node
+
+
+def record_to_way(record: dict) -> osmium.osm.mutable.Way:
+    way = osmium.osm.mutable.Way(nodes=[x['ref'] for x in record['nodes']], **record_to_common_attrs(record))
+    way.user = record['user']
+    return way
+
+
+def record_to_relation(record: dict) -> osmium.osm.mutable.Relation:
+    relation = osmium.osm.mutable.Relation(
+        members=[(m['type'], m['ref'], m['role']) for m in record['members']],
+        **record_to_common_attrs(record),
+    )
+    relation.user = record['user']
+    return relation
+
+
+class AOIIndex:
+    """Lookups of elements in an index built by build_aoi_index()"""
+    def __init__(self, index_path: str):
+        self.conn = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True)
+        self.conn.execute('CREATE TEMP TABLE wanted (id INTEGER PRIMARY KEY)')
+
+    def close(self):
+        self.conn.close()
+
+    def get_count(self, etype: str) -> int:
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (f'{etype}_count',)).fetchone()
+        return int(row[0])
+
+    def _set_wanted(self, ids: Iterable[int]) -> None:
+        self.conn.execute('DELETE FROM wanted')
+        self.conn.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', ((eid,) for eid in ids))
+
+    def get_elements(self, etype: str, ids: Iterable[int]) -> Iterator[Tuple[int, int, float, float, str]]:
+        """id, version, lon, lat and record json of the elements among ids, by id"""
+        self._set_wanted(ids)
+        return self.conn.execute(
+            'SELECT e.id, e.version, e.lon, e.lat, e.record FROM wanted w '
+            'JOIN elements e ON e.type = ? AND e.id = w.id ORDER BY e.id',
+            (INDEX_TYPES[etype],),
+        )
+
+    def get_versions(self, etype: str, ids: Iterable[int]) -> VersionIndex:
+        versions = VersionIndex()
+        self._set_wanted(ids)
+        for eid, version in self.conn.execute(
+            'SELECT e.id, e.version FROM wanted w JOIN elements e ON e.type = ? AND e.id = w.id ORDER BY e.id',
+            (INDEX_TYPES[etype],),
+        ):
+            versions.add(eid, version)
+        return versions
+
+    def get_references(self, node_ids: Iterable[int]) -> Tuple[ReverseReferenceIndex, ReverseReferenceIndex]:
+        """Indexes of the ways and of the relations referring to the nodes"""
+        by_type = {'w': ReverseReferenceIndex(), 'r': ReverseReferenceIndex()}
+        self._set_wanted(node_ids)
+        for node_id, referrer_type, referrer_id in self.conn.execute(
+            'SELECT r.node_id, r.referrer_type, r.referrer_id FROM wanted w '
+            'JOIN node_refs r ON r.node_id = w.id ORDER BY r.node_id, r.referrer_id'
+        ):
+            by_type[referrer_type].add(node_id, referrer_id)
+        return by_type['w'], by_type['r']
+
+
+def scan_aoi_index(tracker, filename, index_path, ref_osm_path, collect_versions=False) -> AOIScanResult:
+    """
+    Same result as scan_aoi_file(), from lookups in the index of the file. The index is built first,
+    if missing or for a different file. Meant for the original aoi, which does not change.
+    """
+    ensure_aoi_index(filename, index_path)
+    tracked = tracker.get_tracked_elements()
+    result = SimpleNamespace(
+        ref_osm_path=ref_osm_path,
+        nodes_ref_osm_path=ref_osm_path + '.nodes.osm',
+        nodes={}, ways={}, relations={}, referring_ways={}, referring_relations={},
+        nodes_versions=VersionIndex(), ways_versions=VersionIndex(), relations_versions=VersionIndex(),
+    )
+    for path in (result.ref_osm_path, result.nodes_ref_osm_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    index = AOIIndex(index_path)
+    try:
+        for etype in INDEX_TYPES:
+            setattr(result, f'{etype}_count', index.get_count(etype))
+            if collect_versions:
+                setattr(result, f'{etype}_versions', index.get_versions(etype, tracked[etype]))
+
+        referenced = tracker.referenced_elements
+        result.nodes_references_by_ways, result.nodes_references_by_relations = \
+            index.get_references(referenced['nodes'])
+        referring_way_ids = result.nodes_references_by_ways.referrer_ids() - referenced['ways']
+        referring_relation_ids = result.nodes_references_by_relations.referrer_ids() - referenced['relations']
+
+        # Same elements as AOIHandler keeps: tracked ones, the ones referring to referenced nodes and
+        # their members. Member ways are kept only for the tracked relations
+        needed_nodes: Set[int] = set()
+        needed_ways: Set[int] = set(tracked['ways']) | result.nodes_references_by_ways.referrer_ids()
+        relations: Dict[int, osmium.osm.mutable.Relation] = {}
+        relation_ids = set(tracked['relations']) | result.nodes_references_by_relations.referrer_ids()
+        for rid, _, _, _, record_json in index.get_elements('relations', relation_ids):
+            record = json.loads(record_json)
+            relations[rid] = record_to_relation(record)
+            if rid in tracked['relations']:
+                result.relations[rid] = record
+            if rid in referring_relation_ids:
+                result.referring_relations[rid] = record
+            for member in record['members']:
+                if member['type'] == 'n':
+                    needed_nodes.add(member['ref'])
+                elif member['type'] == 'w' and rid in tracked['relations']:
+                    needed_ways.add(member['ref'])
+
+        ways: Dict[int, osmium.osm.mutable.Way] = {}
+        for wid, _, _, _, record_json in index.get_elements('ways', needed_ways):
+            record = json.loads(record_json)
+            ways[wid] = record_to_way(record)
+            needed_nodes.update(x['ref'] for x in record['nodes'])
+            if wid in tracked['ways']:
+                result.ways[wid] = record
+            if wid in referring_way_ids:
+                result.referring_ways[wid] = record
+
+        needed_nodes.update(referenced['nodes'])
+        needed_nodes.update(tracker.added_elements['nodes'])
+        nodes: Dict[int, osmium.osm.mutable.Node] = {}
+        locations: Dict[int, Tuple[float, float]] = {}
+        for nid, _, lon, lat, record_json in index.get_elements('nodes', needed_nodes):
+            location = (lon, lat) if lon is not None else None
+            if nid in tracked['nodes']:
+                if record_json is None:
+                    raise Exception(f'Tracked node {nid} has no location')
+                record = json.loads(record_json)
+                nodes[nid] = record_to_node(record, location)
+                result.nodes[nid] = record
+            elif location is not None:
+                record = json.loads(record_json)
+                if record['tags']:
+                    nodes[nid] = record_to_node(record, location)
+                else:
+                    locations[nid] = location
+    finally:
+        index.close()
+
+    write_referenced_elements(
+        result.ref_osm_path, result.nodes_ref_osm_path, needed_nodes,
+        nodes, result.nodes, locations.__getitem__, ways, relations,
+    )
+    return AOIScanResult(result)
@@ -0,0 +1,268 @@
+from datetime import datetime
+from xml.etree import ElementTree as ET
+
+import psycopg2
+
+from replay_tool.models import ReplayToolConfig
+
+from typing import Iterator, List, Optional
+
+from .harvester import HarvestedChangeset
+
+
+# Coordinates are stored as integers in apidb
+COORDINATES_SCALE = 10 ** 7
+
+OSM_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# apidb timestamps are UTC, without timezone. A changeset is open until its closed_at, which is moved
+# forward while it is being edited
+CHANGESET_CLOSED_CONDITION = "closed_at <= (now() AT TIME ZONE 'UTC')"
+
+CHANGESETS_QUERY = f'''
+    SELECT c.id, c.created_at, c.closed_at, c.min_lat, c.min_lon, c.max_lat, c.max_lon, c.num_changes,
+        u.id, u.display_name,
+        ARRAY(SELECT ARRAY[t.k, t.v] FROM changeset_tags t WHERE t.changeset_id = c.id)
+    FROM changesets c JOIN users u ON u.id = c.user_id
+    WHERE c.id BETWEEN %s AND %s AND c.num_changes > 0 AND c.{CHANGESET_CLOSED_CONDITION}
+    ORDER BY c.id
+'''
+
+NODES_QUERY = '''
+    SELECT n.changeset_id, n.node_id, n.version, n.visible, n.timestamp, n.latitude, n.longitude,
+        ARRAY(
+            SELECT ARRAY[t.k, t.v] FROM node_tags t
+            WHERE t.node_id = n.node_id AND t.version = n.version
+        )
+    FROM nodes n
+    WHERE n.changeset_id BETWEEN %s AND %s
+    ORDER BY n.changeset_id, n.node_id, n.version
+'''
+
+WAYS_QUERY = '''
+    SELECT w.changeset_id, w.way_id, w.version, w.visible, w.timestamp,
+        ARRAY(
+            SELECT ARRAY[t.k, t.v] FROM way_tags t
+            WHERE t.way_id = w.way_id AND t.version = w.version
+        ),
+        ARRAY(
+            SELECT wn.node_id FROM way_nodes wn
+            WHERE wn.way_id = w.way_id AND wn.version = w.version
+            ORDER BY wn.sequence_id
+        )
+    FROM ways w
+    WHERE w.changeset_id BETWEEN %s AND %s
+    ORDER BY w.changeset_id, w.way_id, w.version
+'''
+
+RELATIONS_QUERY = '''
+    SELECT r.changeset_id, r.relation_id, r.version, r.visible, r.timestamp,
+        ARRAY(
+            SELECT ARRAY[t.k, t.v] FROM relation_tags t
+            WHERE t.relation_id = r.relation_id AND t.version = r.version
+        ),
+        ARRAY(
+            SELECT ARRAY[lower(m.member_type::text), m.member_id::text, m.member_role] FROM relation_members m
+            WHERE m.relation_id = r.relation_id AND m.version = r.version
+            ORDER BY m.sequence_id
+        )
+    FROM relations r
+    WHERE r.changeset_id BETWEEN %s AND %s
+    ORDER BY r.changeset_id, r.relation_id, r.version
+'''
+
+
+# Changesets up to the first one still open, as the gathered ones are not gathered again
+NEW_CHANGESET_IDS_QUERY = f'''
+    WITH first_open AS (
+        SELECT min(id) AS id FROM changesets WHERE id > %(after)s AND NOT {CHANGESET_CLOSED_CONDITION}
+    )
+    SELECT c.id FROM changesets c, first_open
+    WHERE c.id > %(after)s AND c.num_changes > 0 AND (first_open.id IS NULL OR c.id < first_open.id)
+    ORDER BY c.id
+'''
+
+
+def get_apidb_connection():
+    config = ReplayToolConfig.load()
+    db_config = {
+        'host': config.posm_db_host,
+        'dbname': config.posm_db_name,
+        'user': config.posm_db_user,
+        'password': config.posm_db_password,
+    }
+    return psycopg2.connect(**db_config)
+
+
+def format_timestamp(timestamp: Optional[datetime]) -> Optional[str]:
+    # apidb timestamps are UTC, without timezone
+    return timestamp.strftime(OSM_TIMESTAMP_FORMAT) if timestamp else None
+
+
+def format_coordinate(value: Optional[int]) -> Optional[str]:
+    return str(value / COORDINATES_SCALE) if value is not None else None
+
+
+def set_attrs(elem: ET.Element, **attrs) -> ET.Element:
+    for k, v in attrs.items():
+        if v is not None:
+            elem.set(k, str(v))
+    return elem
+
+
+def add_tags(elem: ET.Element, tags: List[List[str]]) -> None:
+    for k, v in tags:
+        ET.SubElement(elem, 'tag', k=k, v=v)
+
+
+class RowStream:
+    """
+    Rows of a server side cursor whose first column is the changeset id, ordered by it.
+    Only `itersize` rows are held in memory at a time.
+    """
+    def __init__(self, conn, name: str, query: str, params: tuple, itersize: int):
+        self.cursor = conn.cursor(name=name)
+        self.cursor.itersize = itersize
+        self.cursor.execute(query, params)
+        self._rows = iter(self.cursor)
+        self._head = next(self._rows, None)
+
+    def __iter__(self):
+        while self._head is not None:
+            row = self._head
+            self._head = next(self._rows, None)
+            yield row
+
+    def take(self, changeset_id: int) -> list:
+        """Returns rows of the changeset, skipping rows of any earlier changesets"""
+        rows = []
+        while self._head is not None and self._head[0] <= changeset_id:
+            if self._head[0] == changeset_id:
+                rows.append(self._head)
+            self._head = next(self._rows, None)
+        return rows
+
+    def close(self):
+        self.cursor.close()
+
+
+class OSMChangeBuilder:
+    """
+    Builds osmChange xml the way the osm api renders /changeset/#id/download, consecutive
+    elements with same action are grouped in the same action block.
+    """
+    def __init__(self, user: str, uid: int):
+        self.user = user
+        self.uid = uid
+        self.root = ET.Element('osmChange', version='0.6', generator='POSM Replay Tool')
+        self._action = None
+        self._action_el = None
+
+    def _add_element(self, elem_type: str, eid, version, visible, changeset_id, timestamp, **attrs) -> ET.Element:
+        if version == 1:
+            action = 'create'
+        elif not visible:
+            action = 'delete'
+        else:
+            action = 'modify'
+        if action != self._action:
+            self._action = action
+            self._action_el = ET.SubElement(self.root, action)
+        return set_attrs(
+            ET.SubElement(self._action_el, elem_type),
+            id=eid,
+            visible=str(visible).lower(),
+            version=version,
+            changeset=changeset_id,
+            timestamp=format_timestamp(timestamp),
+            user=self.user,
+            uid=self.uid,
+            **attrs,
+        )
+
+    def add_node(self, row) -> None:
+        changeset_id, eid, version, visible, timestamp, lat, lon, tags = row
+        elem = self._add_element(
+            'node', eid, version, visible, changeset_id, timestamp,
+            # Deleted nodes have no location
+            lat=format_coordinate(lat) if visible else None,
+            lon=format_coordinate(lon) if visible else None,
+        )
+        add_tags(elem, tags)
+
+    def add_way(self, row) -> None:
+        changeset_id, eid, version, visible, timestamp, tags, node_ids = row
+        elem = self._add_element('way', eid, version, visible, changeset_id, timestamp)
+        for node_id in node_ids:
+            ET.SubElement(elem, 'nd', ref=str(node_id))
+        add_tags(elem, tags)
+
+    def add_relation(self, row) -> None:
+        changeset_id, eid, version, visible, timestamp, tags, members = row
+        elem = self._add_element('relation', eid, version, visible, changeset_id, timestamp)
+        for member_type, member_id, member_role in members:
+            ET.SubElement(elem, 'member', type=member_type, ref=member_id, role=member_role)
+        add_tags(elem, tags)
+
+    def get_xml(self) -> str:
+        return ET.tostring(self.root, encoding='unicode')
+
+
+def get_changeset_meta_xml(row) -> str:
+    changeset_id, created_at, closed_at, min_lat, min_lon, max_lat, max_lon, num_changes, uid, user, tags = row
+    root = ET.Element('osm', version='0.6', generator='POSM Replay Tool')
+    changeset = set_attrs(
+        ET.SubElement(root, 'changeset'),
+        id=changeset_id,
+        created_at=format_timestamp(created_at),
+        closed_at=format_timestamp(closed_at),
+        open=str(closed_at is not None and closed_at > datetime.utcnow()).lower(),
+        user=user,
+        uid=uid,
+        min_lat=format_coordinate(min_lat),
+        min_lon=format_coordinate(min_lon),
+        max_lat=format_coordinate(max_lat),
+        max_lon=format_coordinate(max_lon),
+        changes_count=num_changes,
+    )
+    add_tags(changeset, tags)
+    return ET.tostring(root, encoding='unicode')
+
+
+def get_new_changeset_ids(conn, after_changeset_id: int = 0) -> List[int]:
+    """
+    Ids of the non empty changesets newer than `after_changeset_id`, in order.
+    Stops before the first open changeset, which may still be edited.
+    """
+    with conn.cursor() as cur:
+        cur.execute(NEW_CHANGESET_IDS_QUERY, {'after': after_changeset_id})
+        return [row[0] for row in cur]
+
+
+def export_changesets(
+    conn, first_changeset_id: int, last_changeset_id: int, itersize: int = 500,
+) -> Iterator[HarvestedChangeset]:
+    """
+    Builds changesets meta and osmChange data straight from the apidb tables, without going
+    through the osm api. Changesets are yielded in changeset id order and the rows are streamed
+    with server side cursors, so memory does not grow with the number of changesets.
+    """
+    params = (first_changeset_id, last_changeset_id)
+    changesets = RowStream(conn, 'replay_changesets', CHANGESETS_QUERY, params, itersize)
+    nodes = RowStream(conn, 'replay_nodes', NODES_QUERY, params, itersize)
+    ways = RowStream(conn, 'replay_ways', WAYS_QUERY, params, itersize)
+    relations = RowStream(conn, 'replay_relations', RELATIONS_QUERY, params, itersize)
+    try:
+        for row in changesets:
+            changeset_id, uid, user = row[0], row[8], row[9]
+            builder = OSMChangeBuilder(user, uid)
+            for node_row in nodes.take(changeset_id):
+                builder.add_node(node_row)
+            for way_row in ways.take(changeset_id):
+                builder.add_way(way_row)
+            for relation_row in relations.take(changeset_id):
+                builder.add_relation(relation_row)
+            yield changeset_id, get_changeset_meta_xml(row), builder.get_xml()
+    finally:
+        for stream in (changesets, nodes, ways, relations):
+            stream.close()
@@ -1,12 +1,16 @@
 import os
 import json
 from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
 
 from replay_tool.models import ReplayToolConfig
 
-from typing import Any, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from mypy_extensions import TypedDict
-from .osmium_handlers import AOIHandler, OSMElementsTracker
+from .compression import GZIPPED_OSM_CHANGE_FORMAT
+from .osmium_handlers import AOIScanResult, ChangesetElementIdsHandler, OSMElementsTracker
 
 
 class FilteredElements(TypedDict):
@@ -56,14 +60,35 @@ def get_current_aoi_info() -> AOIInfo:
         return {'bbox': bbox, 'description': description}
 
 
+LOCAL_AOI_FILE_NAME = 'local_aoi.osm.pbf'
+
+
 def get_local_aoi_path() -> str:
-    return os.path.join(get_aoi_path(), 'local_aoi.osm')
+    return os.path.join(get_aoi_path(), LOCAL_AOI_FILE_NAME)
 
 
 def get_current_aoi_path() -> str:
     return os.path.join(get_aoi_path(), 'current_aoi.osm')
 
 
+def get_current_aoi_state_path() -> str:
+    return os.path.join(get_aoi_path(), 'current_aoi.json')
+
+
+def load_current_aoi_state() -> Optional[dict]:
+    """How and as of when current_aoi.osm was extracted, None if not known"""
+    try:
+        with open(get_current_aoi_state_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_current_aoi_state(state: dict) -> None:
+    with open(get_current_aoi_state_path(), 'w') as f:
+        json.dump(state, f)
+
+
 def get_original_aoi_path() -> str:
     aoi_path = get_aoi_path()
     config = ReplayToolConfig.load()
@@ -73,6 +98,14 @@ def get_original_aoi_path() -> str:
     return os.path.join(aoi_path, original_aoi_name)
 
 
+def get_original_aoi_index_path() -> str:
+    return os.path.join(get_aoi_path(), 'original_aoi.index.sqlite')
+
+
+def get_workspace_path() -> str:
+    return settings.REPLAY_WORKSPACE_DIR or os.path.join(get_aoi_path(), 'replay_workspace')
+
+
 def create_deleted_element(eid):
     return {
         'id': eid,
@@ -84,7 +117,40 @@ def get_overpass_query(s, w, n, e) -> str:
     return f'(node({s},{w},{n},{e});<;>>;>;);out meta;'
 
 
-def filter_elements_from_aoi_handler(tracker: OSMElementsTracker, aoi_handler: AOIHandler) -> FilteredElements:
+def get_overpass_adiff_query(since: str, s, w, n, e) -> str:
+    """Augmented diff of the aoi query between `since` and now"""
+    return f'[adiff:"{since}"];{get_overpass_query(s, w, n, e)}'
+
+
+OVERPASS_ID_FILTERS = {'nodes': 'node', 'ways': 'way', 'relations': 'rel'}
+
+
+def get_overpass_elements_query(elements: Dict[str, List[int]]) -> str:
+    """
+    Query for the given elements, the ways referring to the nodes among them, the relations referring
+    to any of them and everything needed to complete those(nodes of ways, members of relations).
+    @elements: ids of elements by type: nodes, ways and relations
+    """
+    statements = ''.join(
+        f'{OVERPASS_ID_FILTERS[etype]}(id:{",".join(str(x) for x in ids)});'
+        for etype, ids in elements.items() if ids
+    )
+    return f'({statements});(._;way(bn);rel(bn);rel(bw);rel(br););(._;>;);out meta;'
+
+
+def get_overpass_elements_queries(elements: Dict[str, Iterable[int]], batch_size: int) -> List[str]:
+    """Queries for the given elements in batches of at most `batch_size` ids"""
+    typed_ids = [(etype, eid) for etype in OVERPASS_ID_FILTERS for eid in sorted(elements.get(etype, []))]
+    queries = []
+    for batch in chunks(typed_ids, batch_size):
+        batch_elements: Dict[str, List[int]] = {}
+        for etype, eid in batch:
+            batch_elements.setdefault(etype, []).append(eid)
+        queries.append(get_overpass_elements_query(batch_elements))
+    return queries
+
+
+def filter_elements_from_aoi_handler(tracker: OSMElementsTracker, aoi_handler: AOIScanResult) -> FilteredElements:
     """This function is used inside reducer to filter osm elements"""
     elements: FilteredElements = {
         'referenced': {'nodes': {}, 'ways': {}, 'relations': {}},
@@ -115,6 +181,30 @@ def filter_elements_from_aoi_handler(tracker: OSMElementsTracker, aoi_handler: A
     return elements
 
 
+def get_pushed_changeset_ids(changesets: Iterable[Tuple[int, bytes]], not_pushed: Dict[str, Set[int]]) -> List[int]:
+    """
+    Ids of the changesets none of whose elements are among the ones not pushed yet.
+    @changesets: id and gzipped osmChange data of the changesets
+    @not_pushed: ids of the elements by type: nodes, ways and relations
+    """
+    pushed_ids = []
+    for changeset_id, data in changesets:
+        handler = ChangesetElementIdsHandler()
+        handler.apply_buffer(bytes(data), GZIPPED_OSM_CHANGE_FORMAT)
+        if not any(getattr(handler, etype) & ids for etype, ids in not_pushed.items()):
+            pushed_ids.append(changeset_id)
+    return pushed_ids
+
+
+def chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def create_changeset_creation_xml(comment: str, tool_version: str = '1.1') -> str:
     return f'''<?xml version="1.0" encoding="UTF-8"?>
         <osm version="0.6" generator="POSM Replay Tool v{tool_version}">
@@ -0,0 +1,18 @@
+import gzip
+
+from typing import Union
+
+
+# Format suffix osmium uses to read gzipped osmChange data
+GZIPPED_OSM_CHANGE_FORMAT = 'osc.gz'
+
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(text: str) -> bytes:
+    return gzip.compress(text.encode('utf-8'), compresslevel=COMPRESSION_LEVEL)
+
+
+def decompress_text(data: Union[bytes, memoryview]) -> str:
+    # postgres binary fields are returned as memoryview
+    return gzip.decompress(bytes(data)).decode('utf-8')
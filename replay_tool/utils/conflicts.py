@@ -95,18 +95,10 @@ def get_conflicting_elements(
     local_referenced_elements, upstream_referenced_elements, version_handler
 ) -> ConflictingElements:
     # Filter elements that have been changed in upstream, ignore other
-    upstream_changed_nodes = {
-        k: v for k, v in upstream_referenced_elements['nodes'].items()
-        if not v.get('version') or v['version'] > version_handler.nodes_versions[v['id']]
-    }
-    upstream_changed_ways = {
-        k: v for k, v in upstream_referenced_elements['ways'].items()
-        if not v.get('version') or v['version'] > version_handler.ways_versions[v['id']]
-    }
-    upstream_changed_relations = {
-        k: v for k, v in upstream_referenced_elements['relations'].items()
-        if not v.get('version') or v['version'] > version_handler.relations_versions[v['id']]
-    }
+    upstream_changed_nodes = version_handler.nodes_versions.filter_newer(upstream_referenced_elements['nodes'])
+    upstream_changed_ways = version_handler.ways_versions.filter_newer(upstream_referenced_elements['ways'])
+    upstream_changed_relations = \
+        version_handler.relations_versions.filter_newer(upstream_referenced_elements['relations'])
     conflicting_elems: ConflictingElements = {
         'nodes': filter_conflicting_pairs(
             local_referenced_elements['nodes'],
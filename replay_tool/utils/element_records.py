@@ -0,0 +1,38 @@
+"""
+Builds the dicts stored as local_data/upstream_data of OSMElement straight from osmium objects.
+The output is the same as of the serializers in replay_tool.serializers.osm, which are too slow to
+be run for each element while scanning AOI files.
+"""
+
+
+def common_to_dict(o) -> dict:
+    return {
+        'id': o.id,
+        'version': o.version,
+        'changeset': o.changeset,
+        'deleted': o.deleted,
+        'timestamp': str(o.timestamp),
+        'uid': o.uid,
+        'tags': [{'k': t.k, 'v': t.v} for t in o.tags],
+        'user': o.user,
+        'visible': o.visible,
+    }
+
+
+def node_to_dict(n) -> dict:
+    data = common_to_dict(n)
+    location = n.location
+    data['location'] = {'lat': location.lat, 'lon': location.lon}
+    return data
+
+
+def way_to_dict(w) -> dict:
+    data = common_to_dict(w)
+    data['nodes'] = [{'ref': x.ref} for x in w.nodes]
+    return data
+
+
+def relation_to_dict(r) -> dict:
+    data = common_to_dict(r)
+    data['members'] = [{'ref': m.ref, 'role': m.role, 'type': m.type} for m in r.members]
+    return data
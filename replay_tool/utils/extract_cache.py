@@ -0,0 +1,133 @@
+import glob
+import hashlib
+import os
+import shutil
+import threading
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from typing import Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+OSM_BASE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# osm_base timestamp as it appears in the cached file names
+FILE_TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+def link_or_copy(src: str, dest: str) -> None:
+    """Atomically places a copy of src at dest, hard linking it where possible"""
+    temp_path = f'{dest}.link'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(src, temp_path)
+    except OSError:
+        shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dest)
+
+
+class ExtractCache:
+    """
+    Directory of downloaded extracts, named <sha256 of the query>-<osm_base timestamp>.osm, so the
+    name tells which query produced the data and as of when. An entry is fresh while its data is not
+    older than `max_age_secs`, entries with timestamps in the future are never used. Least recently
+    used entries are evicted once the cache grows beyond `max_size_bytes`.
+    """
+    def __init__(self, cache_dir: str, max_age_secs: float, max_size_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_age_secs = max_age_secs
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        # Cached files are used as upstream data, only the owner may write to the cache
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def get_key(*parts: str) -> str:
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key: str, osm_base: str) -> str:
+        timestamp = datetime.strptime(osm_base, OSM_BASE_FORMAT).strftime(FILE_TIMESTAMP_FORMAT)
+        return os.path.join(self.cache_dir, f'{key}-{timestamp}.osm')
+
+    def lookup(self, key: str) -> Optional[Tuple[str, str]]:
+        """Returns path and osm_base of the newest fresh entry for the key, if any"""
+        now = datetime.now(timezone.utc)
+        # Timestamps sort the same as strings
+        for path in sorted(glob.glob(os.path.join(self.cache_dir, f'{key}-*.osm')), reverse=True):
+            osm_base_at = datetime.strptime(
+                os.path.basename(path)[len(key) + 1:-len('.osm')], FILE_TIMESTAMP_FORMAT,
+            ).replace(tzinfo=timezone.utc)
+            if osm_base_at <= now:
+                break
+        else:
+            return None
+        if (now - osm_base_at).total_seconds() > self.max_age_secs:
+            return None
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            # Evicted meanwhile
+            return None
+        return path, osm_base_at.strftime(OSM_BASE_FORMAT)
+
+    def get(self, key: str, dest: str) -> Optional[str]:
+        """Places the newest fresh entry for the key at dest, returns its osm_base or None on a miss"""
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        path, osm_base = entry
+        try:
+            link_or_copy(path, dest)
+        except OSError:
+            return None
+        logger.info(f'Using cached extract {os.path.basename(path)}, upstream data as of {osm_base}')
+        return osm_base
+
+    def put(self, key: str, src: str, osm_base: Optional[str]) -> None:
+        """Adds a copy of src to the cache, data without osm_base timestamp can't be cached"""
+        if not osm_base:
+            return
+        link_or_copy(src, self.get_entry_path(key, osm_base))
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.cache_dir, '*.osm')):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total_size -= size
+
+
+_extract_cache: Optional[ExtractCache] = None
+
+
+def get_extract_cache() -> Optional[ExtractCache]:
+    """Extract cache configured in settings, None if disabled"""
+    global _extract_cache
+    if not settings.UPSTREAM_EXTRACT_CACHE_DIR:
+        return None
+    if _extract_cache is None:
+        _extract_cache = ExtractCache(
+            settings.UPSTREAM_EXTRACT_CACHE_DIR,
+            settings.UPSTREAM_EXTRACT_CACHE_MAX_AGE_SECS,
+            settings.UPSTREAM_EXTRACT_CACHE_MAX_SIZE_MB * 1024 * 1024,
+        )
+    return _extract_cache
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .common import chunks
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# (changeset_id, meta xml, osmChange xml)
+HarvestedChangeset = Tuple[int, str, str]
+
+
+class RateLimiter:
+    """
+    Spaces out calls to wait() so that at most `max_per_sec` of them return per second,
+    no matter how many threads share the limiter. A non positive rate disables limiting.
+    """
+    def __init__(self, max_per_sec: float):
+        self.interval = 1.0 / max_per_sec if max_per_sec and max_per_sec > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ChangesetHarvester:
+    """
+    Fetches changesets(meta and data) through a bounded pool of worker threads.
+    Only network calls happen in the workers, the harvested changesets are yielded to the caller
+    in batches sorted by changeset id, so the caller can save them in changeset order.
+
+    @fetch_meta: callable(changeset_id) returning meta xml, or None if the changeset does not exist
+    @fetch_data: callable(changeset_id) returning osmChange xml
+    @workers: number of concurrent fetches
+    @max_per_sec: maximum number of requests per second, shared by all the workers
+    """
+    def __init__(
+        self,
+        fetch_meta: Callable[[int], Optional[str]],
+        fetch_data: Callable[[int], str],
+        workers: int = 4,
+        max_per_sec: float = 0,
+    ):
+        self.fetch_meta = fetch_meta
+        self.fetch_data = fetch_data
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(max_per_sec)
+
+    def fetch(self, changeset_id: int) -> Optional[HarvestedChangeset]:
+        self.limiter.wait()
+        meta = self.fetch_meta(changeset_id)
+        if meta is None:
+            return None
+        self.limiter.wait()
+        data = self.fetch_data(changeset_id)
+        return changeset_id, meta, data
+
+    def harvest(self, changeset_ids: List[int]) -> Iterator[List[HarvestedChangeset]]:
+        """
+        Fetches the given changesets, a window of a few changesets per worker at a time, and yields
+        the changesets of each window in the order of `changeset_ids`.
+        Raises exception at the first changeset which can't be found, after yielding the ones before it,
+        so that the changesets saved never skip over one which is not.
+        """
+        window = self.workers * 4
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for ids in chunks(changeset_ids, window):
+                # executor.map() returns results in the order of the ids
+                results = list(executor.map(self.fetch, ids))
+                if None not in results:
+                    yield results
+                    continue
+                missing_index = results.index(None)
+                if missing_index:
+                    yield results[:missing_index]
+                raise Exception(f'Changeset {ids[missing_index]} could not be fetched')
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from typing import Dict, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class HTTPClient:
+    """
+    Http client shared by the osm api and overpass calls. It keeps pooled keep-alive connections,
+    asks for gzipped responses, sets timeouts and retries with exponential backoff on connection
+    errors and 429/5xx responses. Latency of the requests is recorded per host, until it is logged.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        connect_timeout: float = 10,
+        read_timeout: float = 300,
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        pool_size: int = 10,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            respect_retry_after_header=True,
+            # Return the last response instead of raising, callers check status codes
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, dict] = {}
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self.record_latency(url, time.monotonic() - start)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def record_latency(self, url: str, secs: float) -> None:
+        host = urlparse(url).netloc
+        with self._lock:
+            stats = self.latencies.setdefault(host, {'count': 0, 'total_secs': 0.0, 'max_secs': 0.0})
+            stats['count'] += 1
+            stats['total_secs'] += secs
+            stats['max_secs'] = max(stats['max_secs'], secs)
+
+    def get_latency_stats(self, reset: bool = False) -> Dict[str, dict]:
+        with self._lock:
+            latency_stats = {
+                host: {**stats, 'avg_secs': stats['total_secs'] / stats['count']}
+                for host, stats in self.latencies.items()
+            }
+            if reset:
+                self.latencies = {}
+            return latency_stats
+
+    def log_latency_stats(self) -> None:
+        """Logs the stats of the requests since they were last logged"""
+        for host, stats in self.get_latency_stats(reset=True).items():
+            logger.info(
+                f"{host}: {stats['count']} requests, avg {stats['avg_secs']:.3f}s, max {stats['max_secs']:.3f}s"
+            )
+
+
+_client: Optional[HTTPClient] = None
+_client_pid: Optional[int] = None
+
+
+def get_http_client() -> HTTPClient:
+    """Returns the client of current process, pooled connections can't be shared by forked workers"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = HTTPClient(
+            connect_timeout=settings.HTTP_CONNECT_TIMEOUT_SECS,
+            read_timeout=settings.HTTP_READ_TIMEOUT_SECS,
+            retries=settings.HTTP_MAX_RETRIES,
+            backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+            pool_size=settings.HTTP_POOL_SIZE,
+        )
+        _client_pid = os.getpid()
+    return _client
@@ -1,7 +1,7 @@
-import requests
-
 from replay_tool.models import ReplayToolConfig
 
+from .http import get_http_client
+
 
 from typing import Optional
 
@@ -9,7 +9,7 @@ from typing import Optional
 def get_changeset_meta(changeset_id, config: ReplayToolConfig) -> Optional[str]:
     osm_base_url = config.osm_base_url
     meta_url = f'{osm_base_url}/api/0.6/changeset/{changeset_id}'
-    response = requests.get(meta_url)
+    response = get_http_client().get(meta_url)
     status_code = response.status_code
     if status_code == 404:
         return None
@@ -23,7 +23,7 @@ def get_changeset_data(changeset_id, config: ReplayToolConfig) -> str:
     if not osm_base_url:
         raise Exception('osm_base_url not configured')
     meta_url = f'{osm_base_url}/api/0.6/changeset/{changeset_id}/download'
-    response = requests.get(meta_url)
+    response = get_http_client().get(meta_url)
     status_code = response.status_code
     if status_code != 200:
         raise Exception(f'Status code {status_code} while getting changeset')
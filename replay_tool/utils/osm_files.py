@@ -0,0 +1,74 @@
+import os
+
+import osmium
+
+from typing import Iterable, List
+
+
+def get_temp_output_path(path: str) -> str:
+    # osmium detects the output format from the file extension, so keep it as it is
+    root, ext = os.path.splitext(path)
+    return f'{root}.part{ext}'
+
+
+def merge_osm_files(paths: List[str], output_path: str) -> str:
+    """
+    Merges osm files into `output_path`. Objects are sorted by type and id and only the latest
+    version of an object present in several files is kept.
+    MergeInputReader reads all of the files into memory before merging, so memory use grows with the
+    total size of the inputs, about that of the whole aoi when merging the tiles of an extract.
+    """
+    temp_path = get_temp_output_path(output_path)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    reader = osmium.MergeInputReader()
+    for path in paths:
+        reader.add_file(path)
+    writer = osmium.WriteHandler(temp_path)
+    try:
+        reader.apply(writer, simplify=True)
+    finally:
+        writer.close()
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def apply_merged_changes(changes: osmium.MergeInputReader, base_path: str, output_path: str) -> str:
+    """
+    Applies the changes to the base osm file and writes the result, without history, to `output_path`.
+    The base file needs to be sorted by type and id, as extracts from osmium and overpass are.
+    The base file is streamed, only the changes are held in memory.
+    """
+    temp_path = get_temp_output_path(output_path)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    reader = osmium.io.Reader(base_path)
+    writer = osmium.io.Writer(temp_path)
+    try:
+        # Only the latest version of an object is kept and deleted objects are dropped
+        changes.apply_to_reader(reader, writer, with_history=False)
+    finally:
+        writer.close()
+        reader.close()
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def apply_osm_changes(base_path: str, change_paths: List[str], output_path: str) -> str:
+    """Applies osmChange files to the base osm file, see apply_merged_changes()"""
+    changes = osmium.MergeInputReader()
+    for path in change_paths:
+        changes.add_file(path)
+    return apply_merged_changes(changes, base_path, output_path)
+
+
+def apply_osm_change_buffers(base_path: str, buffers: Iterable[bytes], data_format: str, output_path: str) -> str:
+    """
+    Applies in memory osmChange documents to the base osm file, see apply_merged_changes().
+    The documents are parsed one at a time, but the parsed changes of all of them are held in memory
+    until they are applied, so memory use grows with the total size of the documents.
+    """
+    changes = osmium.MergeInputReader()
+    for buffer in buffers:
+        changes.add_buffer(buffer, data_format)
+    return apply_merged_changes(changes, base_path, output_path)
@@ -1,13 +1,14 @@
 import osmium
 import os
 
-from typing import Dict, List
+from typing import Callable, Dict, Set
 
-from replay_tool.serializers.osm import (
-    NodeSerializer,
-    WaySerializer,
-    RelationSerializer,
-)
+from .reference_index import ReverseReferenceIndex
+from .version_index import VersionIndex
+from .element_records import node_to_dict, way_to_dict, relation_to_dict
+
+import logging
+logger = logging.getLogger(__name__)
 
 
 class VersionHandler(osmium.SimpleHandler):
@@ -30,11 +31,148 @@ class VersionHandler(osmium.SimpleHandler):
         self.relations_versions[r.id] = r.version
 
 
-def elem_in_tracker(eid, etype, tracker):
-    return \
-        eid in tracker.referenced_elements[etype] \
-        or eid in tracker.added_elements[etype] \
-        or eid in tracker.deleted_elements[etype]
+def copy_common_attrs(o) -> dict:
+    return {
+        'id': o.id,
+        'version': o.version,
+        'visible': o.visible,
+        'changeset': o.changeset,
+        'timestamp': o.timestamp,
+        'uid': o.uid,
+        'tags': [(t.k, t.v) for t in o.tags],
+    }
+
+
+def copy_node(n) -> osmium.osm.mutable.Node:
+    """
+    Copy of the node which stays valid after the handler callback returns, unlike the osmium object.
+    The copies can be written with osmium.SimpleWriter.
+    """
+    location = (n.location.lon, n.location.lat) if n.location.valid() else None
+    node = osmium.osm.mutable.Node(location=location, **copy_common_attrs(n))
+    node.user = n.user
+    return node
+
+
+def copy_way(w) -> osmium.osm.mutable.Way:
+    way = osmium.osm.mutable.Way(nodes=[x.ref for x in w.nodes], **copy_common_attrs(w))
+    way.user = w.user
+    return way
+
+
+def copy_relation(r) -> osmium.osm.mutable.Relation:
+    relation = osmium.osm.mutable.Relation(
+        members=[(m.type, m.ref, m.role) for m in r.members], **copy_common_attrs(r),
+    )
+    relation.user = r.user
+    return relation
+
+
+class AOIRelationsScanner(osmium.SimpleHandler):
+    """
+    First pass of AOIHandler, over relations only. Finds the relations to keep, tracked ones
+    and the ones referring to referenced nodes, and the members they need.
+    Nested relations are not followed.
+    """
+    def __init__(self, tracker, tracked_elements, referenced_nodes):
+        super().__init__()
+        self.tracker = tracker
+        self.tracked_elements = tracked_elements
+        self.referenced_nodes = referenced_nodes
+        self.relations_count = 0
+        self.nodes_references_by_relations = ReverseReferenceIndex()
+        self.needed_relations: Set[int] = set()
+        self.needed_ways: Set[int] = set()
+        self.needed_nodes: Set[int] = set()
+
+    def relation(self, r):
+        self.relations_count += 1
+        referenced_nodes = self.referenced_nodes
+        refers_tracked_node = False
+        for member in r.members:
+            if member.type == 'n' and member.ref in referenced_nodes:
+                self.nodes_references_by_relations.add(member.ref, r.id)
+                refers_tracked_node = True
+        tracked = r.id in self.tracked_elements['relations']
+        if not refers_tracked_node and not tracked:
+            return
+        self.needed_relations.add(r.id)
+        for member in r.members:
+            if member.type == 'n':
+                self.needed_nodes.add(member.ref)
+            elif member.type == 'w' and tracked:
+                # Member ways are shown only for the tracked relations
+                self.needed_ways.add(member.ref)
+
+
+class AOIWaysScanner(osmium.SimpleHandler):
+    """
+    Second pass of AOIHandler, over ways only. Finds the ways to keep, tracked ones, the ones referring
+    to referenced nodes and members of kept relations, and the nodes they need.
+    """
+    def __init__(self, tracker, tracked_elements, referenced_nodes, needed_ways: Set[int], needed_nodes: Set[int]):
+        super().__init__()
+        self.tracker = tracker
+        self.tracked_elements = tracked_elements
+        self.referenced_nodes = referenced_nodes
+        self.ways_count = 0
+        self.nodes_references_by_ways = ReverseReferenceIndex()
+        self.needed_ways = needed_ways
+        self.needed_nodes = needed_nodes
+
+    def way(self, w):
+        self.ways_count += 1
+        referenced_nodes = self.referenced_nodes
+        refers_tracked_node = False
+        for node in w.nodes:
+            if node.ref in referenced_nodes:
+                self.nodes_references_by_ways.add(node.ref, w.id)
+                refers_tracked_node = True
+        if refers_tracked_node or w.id in self.needed_ways or w.id in self.tracked_elements['ways']:
+            self.needed_ways.add(w.id)
+            self.needed_nodes.update(x.ref for x in w.nodes)
+
+
+def write_referenced_elements(
+    ref_osm_path: str,
+    nodes_ref_osm_path: str,
+    needed_nodes: Set[int],
+    nodes: Dict[int, osmium.osm.mutable.Node],
+    tracked_nodes: Dict[int, dict],
+    get_location: Callable,
+    ways: Dict[int, osmium.osm.mutable.Way],
+    relations: Dict[int, osmium.osm.mutable.Relation],
+) -> None:
+    """
+    Writes the needed elements to ref_osm_path and the tracked nodes to nodes_ref_osm_path.
+    Needed nodes with a full copy in `nodes`, tracked and tagged ones, are written as they are. The
+    others are written with just the location from `get_location`, which raises KeyError for unknown
+    nodes, without version and metadata.
+    """
+    # Add to writer, the referenced nodes and elements because they need to be shown in the ui
+    writer = osmium.SimpleWriter(ref_osm_path)
+    nodes_writer = osmium.SimpleWriter(nodes_ref_osm_path)
+    try:
+        for nid in sorted(needed_nodes):
+            if nid in nodes:
+                writer.add_node(nodes[nid])
+                if nid in tracked_nodes:
+                    nodes_writer.add_node(nodes[nid])
+                continue
+            try:
+                location = get_location(nid)
+            except KeyError:
+                # Not in the file, or without location
+                continue
+            # Nodes needed for the geometry of ways and relations are written with just the location
+            writer.add_node(osmium.osm.mutable.Node(id=nid, location=location))
+        for wid in sorted(ways):
+            writer.add_way(ways[wid])
+        for rid in sorted(relations):
+            writer.add_relation(relations[rid])
+    finally:
+        writer.close()
+        nodes_writer.close()
 
 
 class AOIHandler(osmium.SimpleHandler):
@@ -43,32 +181,43 @@ class AOIHandler(osmium.SimpleHandler):
     @tracker: An instance of OSMElementsTracker class
         This is used to filter elements referenced/added in the tracker
     @ref_osm_path: filepath(osm) string for re-storing referenced elements
+
+    @location_index: osmium location index type for the nodes which are needed just for their location,
+        one of osmium.index.map_types(). File based indexes are kept next to ref_osm_path.
+    @collect_versions: also keep versions of the tracked elements, in VersionIndexes
+
+    The file is read in passes. The first two only collect ids of the elements needed: tracked elements,
+    ways and relations referring to the referenced nodes and the members of all of them. The last pass
+    keeps copies of just the needed elements, so memory depends on the changes and not on the AOI size.
+    Only locations of the untracked and untagged nodes are kept, in the location index. Sparse indexes need
+    the nodes sorted by id, as they are in the AOI files.
     """
-    def __init__(self, tracker, ref_osm_path):
+    def __init__(self, tracker, ref_osm_path, location_index='sparse_mem_array', collect_versions=False):
         super().__init__()
         self.tracker = tracker
+        # Any of added, referenced or deleted, so that the check for each element is a single lookup
+        self.tracked_elements = tracker.get_tracked_elements()
+        self.referenced_nodes = tracker.referenced_elements['nodes']
         self.ref_osm_path = ref_osm_path
-        self.nodes_references_by_ways: Dict[int, List[int]] = {}
-        self.nodes_references_by_relations: Dict[int, List[int]] = {}
+        self.location_index = location_index
+        self.collect_versions = collect_versions
+        self.locations_path = ref_osm_path + '.locations'
+        # Only for the referenced nodes
+        self.nodes_references_by_ways = ReverseReferenceIndex()
+        self.nodes_references_by_relations = ReverseReferenceIndex()
         # TODO: may need ways references by relations and
         # relations references by relations
 
         # osmfile to write referenced/added elements only
-        try:
-            os.remove(ref_osm_path)
-        except OSError:
-            pass
-
-        self.writer = osmium.SimpleWriter(ref_osm_path)
-        # We need nodes writer as well because nodes referenced won't be
+        # We need nodes file as well because nodes referenced won't be
         # present in geojson which is extracted later
         # (the library osm2geojson does not include refrerenced nodes in geojson)
-        nodes_ref_path = ref_osm_path + '.nodes.osm'
-        try:
-            os.remove(nodes_ref_path)
-        except OSError:
-            pass
-        self.nodes_writer = osmium.SimpleWriter(nodes_ref_path)
+        self.nodes_ref_osm_path = ref_osm_path + '.nodes.osm'
+        for path in (ref_osm_path, self.nodes_ref_osm_path, self.locations_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
         self.nodes_count = 0
         self.ways_count = 0
@@ -80,87 +229,180 @@ class AOIHandler(osmium.SimpleHandler):
         self.referring_ways: Dict[int, dict] = {}
         self.referring_relations: Dict[int, dict] = {}
 
-        self._nodes: Dict[int, object] = {}
-        self._ways: Dict[int, object] = {}
-        self._relations: Dict[int, object] = {}
+        self.nodes_versions = VersionIndex()
+        self.ways_versions = VersionIndex()
+        self.relations_versions = VersionIndex()
+
+        self.needed_nodes: Set[int] = set()
+        self.needed_ways: Set[int] = set()
+        self.needed_relations: Set[int] = set()
+        self.referring_way_ids: Set[int] = set()
+        self.referring_relation_ids: Set[int] = set()
+
+        self._nodes: Dict[int, osmium.osm.mutable.Node] = {}
+        self._locations = None
+        self._ways: Dict[int, osmium.osm.mutable.Way] = {}
+        self._relations: Dict[int, osmium.osm.mutable.Relation] = {}
+
+    def collect_needed_ids(self, filename):
+        # Relations come last in the file, so their members are known only after a pass over them
+        relations_scanner = AOIRelationsScanner(self.tracker, self.tracked_elements, self.referenced_nodes)
+        relations_scanner.apply_file(filename)
+        self.relations_count = relations_scanner.relations_count
+        self.nodes_references_by_relations = relations_scanner.nodes_references_by_relations
+        self.needed_relations = relations_scanner.needed_relations
+
+        ways_scanner = AOIWaysScanner(
+            self.tracker, self.tracked_elements, self.referenced_nodes,
+            relations_scanner.needed_ways, relations_scanner.needed_nodes,
+        )
+        ways_scanner.apply_file(filename)
+        self.ways_count = ways_scanner.ways_count
+        self.nodes_references_by_ways = ways_scanner.nodes_references_by_ways
+        self.needed_ways = ways_scanner.needed_ways
+        self.needed_nodes = ways_scanner.needed_nodes
+        self.needed_nodes.update(self.tracker.referenced_elements['nodes'])
+        self.needed_nodes.update(self.tracker.added_elements['nodes'])
+
+        # The ways and relations which reference nodes that are referenced in the changesets
+        self.referring_way_ids = \
+            self.nodes_references_by_ways.referrer_ids() - self.tracker.referenced_elements['ways']
+        self.referring_relation_ids = \
+            self.nodes_references_by_relations.referrer_ids() - self.tracker.referenced_elements['relations']
+
+    def create_location_index(self):
+        if '_file_' in self.location_index:
+            return osmium.index.create_map(f'{self.location_index},{self.locations_path}')
+        return osmium.index.create_map(self.location_index)
 
     def apply_file_and_cleanup(self, filename):
-        self.apply_file(filename)
-
-        # Add to writer, the referenced nodes and elements because they need to be shown in the ui
-        # The idea is to add the ways and relations which reference nodes that
-        # are referenced in the changesets
-        for nodeid in self.tracker.referenced_elements['nodes']:
-            for wayid in self.nodes_references_by_ways.get(nodeid, []):
-                if wayid not in self.tracker.referenced_elements['ways']:
-                    self.referring_ways[wayid] = WaySerializer(self._ways[wayid]).data
-                    for node in self._ways[wayid].nodes:
-                        if node.ref not in self.nodes:
-                            self.writer.add_node(self._nodes[node.ref])
-                    self.writer.add_way(self._ways[wayid])
-            for relid in self.nodes_references_by_relations.get(nodeid, []):
-                if relid not in self.tracker.referenced_elements['relations']:
-                    self.referring_relations[relid] = RelationSerializer(self._relations[relid]).data
-                    for member in self._relations[relid].members:
-                        if member.type == 'node' and member.ref not in self.nodes:
-                            self.writer.add_node(self._nodes[member.ref])
-                    self.writer.add_relation(self._relations[relid])
-
-        self.writer.close()
-        self.nodes_writer.close()
+        self.collect_needed_ids(filename)
+        self._locations = self.create_location_index()
+        try:
+            self.apply_file(filename)
+            self.write_referenced_elements()
+        finally:
+            self._locations.clear()
+            self._locations = None
+            if os.path.exists(self.locations_path):
+                os.remove(self.locations_path)
 
         self._nodes.clear()
         self._ways.clear()
+        self._relations.clear()
+
+    def write_referenced_elements(self):
+        write_referenced_elements(
+            self.ref_osm_path, self.nodes_ref_osm_path, self.needed_nodes,
+            self._nodes, self.nodes, self._locations.get, self._ways, self._relations,
+        )
 
     def node(self, n):
-        self._nodes[n.id] = n
         self.nodes_count += 1
-        if elem_in_tracker(n.id, 'nodes', self.tracker):
-            self.nodes[n.id] = NodeSerializer(n).data
-            # Write to writer to get osm file which is later converted to geojson
-            self.writer.add_node(n)
-            # Add it to node writer as well
-            self.nodes_writer.add_node(n)
+        if self.collect_versions and n.id in self.tracked_elements['nodes']:
+            self.nodes_versions.add(n.id, n.version)
+        if n.id not in self.needed_nodes:
+            return
+        if n.id in self.tracked_elements['nodes']:
+            if not n.location.valid():
+                raise Exception(f'Tracked node {n.id} has no location')
+            self._nodes[n.id] = copy_node(n)
+            self.nodes[n.id] = node_to_dict(n)
+        elif len(n.tags):
+            # Tagged nodes of ways, like POIs, are shown with their tags
+            self._nodes[n.id] = copy_node(n)
+        elif n.location.valid():
+            self._locations.set(n.id, n.location)
 
     def way(self, w):
-        self._ways[w.id] = w
-        self.ways_count += 1
-        # Add way to node references
-        for node in w.nodes:
-            self.nodes_references_by_ways[node.ref] = [
-                *self.nodes_references_by_ways.get(node.ref, []),
-                w.id
-            ]
-
-        if elem_in_tracker(w.id, 'ways', self.tracker):
-            self.ways[w.id] = WaySerializer(w).data
-            # Write to writer to get osm file which is later converted to geojson
-            for node in w.nodes:
-                self.writer.add_node(self._nodes[node.ref])
-            self.writer.add_way(w)
+        if self.collect_versions and w.id in self.tracked_elements['ways']:
+            self.ways_versions.add(w.id, w.version)
+        if w.id not in self.needed_ways:
+            return
+        self._ways[w.id] = copy_way(w)
+        if w.id in self.tracked_elements['ways']:
+            self.ways[w.id] = way_to_dict(w)
+        if w.id in self.referring_way_ids:
+            self.referring_ways[w.id] = way_to_dict(w)
 
     def relation(self, r):
-        self._relations[r.id] = r
-        self.relations_count += 1
-        # Add relation to node references
-        for member in r.members:
-            if member.type == 'n':
-                self.nodes_references_by_relations[member.ref] = [
-                    *self.nodes_references_by_relations.get(member.ref, []),
-                    r.id
-                ]
-        if elem_in_tracker(r.id, 'relations', self.tracker):
-            self.relations[r.id] = RelationSerializer(r).data
-            # Write to writer to get osm file which is later converted to geojson
-            for member in r.members:
-                if member.type == 'w':
-                    for node in self._ways[member.ref].nodes:
-                        self.writer.add_node(self._nodes[node.ref])
-                    self.writer.add_way(self._ways[member.ref])
-                elif member.type == 'n':
-                    self.writer.add_node(self._nodes[member.ref])
-                # TODO: member.type == 'relation'
-            self.writer.add_relation(r)
+        if self.collect_versions and r.id in self.tracked_elements['relations']:
+            self.relations_versions.add(r.id, r.version)
+        if r.id not in self.needed_relations:
+            return
+        self._relations[r.id] = copy_relation(r)
+        if r.id in self.tracked_elements['relations']:
+            self.relations[r.id] = relation_to_dict(r)
+        if r.id in self.referring_relation_ids:
+            self.referring_relations[r.id] = relation_to_dict(r)
+
+
+class AOIScanResult:
+    """
+    What is used of an AOIHandler once it has scanned the file. Unlike the handler, it can be pickled,
+    so files can be scanned in other processes.
+    """
+    FIELDS = (
+        'ref_osm_path', 'nodes_ref_osm_path',
+        'nodes_count', 'ways_count', 'relations_count',
+        'nodes', 'ways', 'relations', 'referring_ways', 'referring_relations',
+        'nodes_references_by_ways', 'nodes_references_by_relations',
+        'nodes_versions', 'ways_versions', 'relations_versions',
+    )
+
+    def __init__(self, handler: AOIHandler):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(handler, field))
+
+
+def scan_aoi_file(tracker, filename, ref_osm_path, location_index='sparse_mem_array', collect_versions=False):
+    """Scans the file with AOIHandler, see AOIHandler for the arguments"""
+    handler = AOIHandler(tracker, ref_osm_path, location_index, collect_versions)
+    handler.apply_file_and_cleanup(filename)
+    return AOIScanResult(handler)
+
+
+class ChangesetElementsHandler(osmium.SimpleHandler):
+    """
+    Keeps the latest data of the wanted elements, out of changesets applied in order.
+    @wanted: ids of the elements by type: nodes, ways and relations
+    """
+    def __init__(self, wanted: Dict[str, Set[int]]):
+        super().__init__()
+        self.wanted = wanted
+        self.nodes: Dict[int, dict] = {}
+        self.ways: Dict[int, dict] = {}
+        self.relations: Dict[int, dict] = {}
+
+    def node(self, n):
+        if n.id in self.wanted['nodes']:
+            self.nodes[n.id] = node_to_dict(n)
+
+    def way(self, w):
+        if w.id in self.wanted['ways']:
+            self.ways[w.id] = way_to_dict(w)
+
+    def relation(self, r):
+        if r.id in self.wanted['relations']:
+            self.relations[r.id] = relation_to_dict(r)
+
+
+class ChangesetElementIdsHandler(osmium.SimpleHandler):
+    """Ids of the elements in a changeset, by type: nodes, ways and relations"""
+    def __init__(self):
+        super().__init__()
+        self.nodes: Set[int] = set()
+        self.ways: Set[int] = set()
+        self.relations: Set[int] = set()
+
+    def node(self, n):
+        self.nodes.add(n.id)
+
+    def way(self, w):
+        self.ways.add(w.id)
+
+    def relation(self, r):
+        self.relations.add(r.id)
 
 
 class OSMElementsTracker:
@@ -182,19 +424,41 @@ class OSMElementsTracker:
             'nodes': set(), 'relations': set(), 'ways': set()
         }
 
-    def get_added_elements(self, aoi_handler):
+    def get_tracked_elements(self) -> Dict[str, Set[int]]:
+        """
+        Ids which are added, referenced or deleted, by element type. Not updated by later changes,
+        meant to be built once per scan.
+        """
         return {
-            'nodes': [
-                aoi_handler.nodes[k] for k in self.added_elements['nodes']
-            ],
-            'ways': [
-                aoi_handler.ways[k] for k in self.added_elements['ways']
-            ],
-            'relations': [
-                aoi_handler.relations[k] for k in self.added_elements['relations']
-            ],
+            etype: self.referenced_elements[etype] | self.added_elements[etype] | self.deleted_elements[etype]
+            for etype in self.referenced_elements
+        }
+
+    def get_missing_elements(self, aoi_handler) -> Dict[str, Set[int]]:
+        """Added and modified elements which are not in the extract of aoi_handler"""
+        return {
+            etype: {
+                k for ids in (self.added_elements[etype], self.modified_elements[etype]) for k in ids
+                if k not in getattr(aoi_handler, etype)
+            }
+            for etype in ('nodes', 'ways', 'relations')
         }
 
+    @staticmethod
+    def get_elements_in_handler(elements: Dict[str, Set[int]], aoi_handler, description: str):
+        # Elements outside the extract of aoi_handler are left out, with a warning as they won't be pushed
+        result = {}
+        for etype in ('nodes', 'ways', 'relations'):
+            ids, records = elements[etype], getattr(aoi_handler, etype)
+            missing = [k for k in ids if k not in records]
+            if missing:
+                logger.warning(f'{len(missing)} {description} {etype} are not in the extract, left out: {missing}')
+            result[etype] = [records[k] for k in ids if k in records]
+        return result
+
+    def get_added_elements(self, aoi_handler):
+        return self.get_elements_in_handler(self.added_elements, aoi_handler, 'added')
+
     def get_deleted_elements(self, aoi_handler):
         return {
             'nodes': [
@@ -209,17 +473,7 @@ class OSMElementsTracker:
         }
 
     def get_modified_elements(self, aoi_handler):
-        return {
-            'nodes': [
-                aoi_handler.nodes[k] for k in self.modified_elements['nodes']
-            ],
-            'ways': [
-                aoi_handler.ways[k] for k in self.modified_elements['ways']
-            ],
-            'relations': [
-                aoi_handler.relations[k] for k in self.modified_elements['relations']
-            ],
-        }
+        return self.get_elements_in_handler(self.modified_elements, aoi_handler, 'modified')
 
     def get_referenced_elements(self, aoi_handler):
         return {
@@ -0,0 +1,120 @@
+import os
+import time
+import uuid
+
+from typing import Dict, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Job files, see scripts/pipe_reader_writer.sh which runs the jobs on the host
+#   <job_id>.cmd: shell command of a job, waiting to be picked up
+#   <job_id>.running: the command, once picked up
+#   <job_id>.status: exit code on the first line followed by error output, once finished
+#   <job_id>.auth: osmosis authFile of the job, if any, its path is passed to the command as $JOB_AUTH_FILE
+#   <job_id>.deadline: seconds after which the runner kills the job, if any
+# The runner also kills a job whose .running file is removed, see cleanup_job()
+JOB_COMMAND_EXT = '.cmd'
+JOB_RUNNING_EXT = '.running'
+JOB_STATUS_EXT = '.status'
+JOB_AUTH_EXT = '.auth'
+JOB_DEADLINE_EXT = '.deadline'
+JOB_TEMP_EXT = '.tmp'
+
+
+def write_private_file(path: str, content: str) -> None:
+    """Writes a new file which only the owner can read"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+
+
+def get_auth_file_content(auth: Dict[str, str]) -> str:
+    """Osmosis authFile with the database options in auth, like host, user and password"""
+    if any('\n' in str(value) for value in auth.values()):
+        raise Exception('Osmosis database options can not contain line breaks')
+    return ''.join(f'{key}={value}\n' for key, value in auth.items())
+
+
+def submit_job(
+    jobs_dir: str,
+    command: str,
+    auth: Optional[Dict[str, str]] = None,
+    deadline_secs: Optional[float] = None,
+) -> str:
+    """
+    Queues the shell command for the job runner, returns the job id.
+    Database credentials in auth are written to an authFile for the command, instead of the command.
+    """
+    os.makedirs(jobs_dir, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    path = os.path.join(jobs_dir, job_id + JOB_COMMAND_EXT)
+    try:
+        if auth:
+            write_private_file(os.path.join(jobs_dir, job_id + JOB_AUTH_EXT), get_auth_file_content(auth))
+        if deadline_secs is not None:
+            write_private_file(os.path.join(jobs_dir, job_id + JOB_DEADLINE_EXT), f'{deadline_secs:g}\n')
+        # Write and then rename, so the runner never picks up a partially written command
+        write_private_file(path + JOB_TEMP_EXT, command)
+        os.replace(path + JOB_TEMP_EXT, path)
+    except Exception:
+        cleanup_job(jobs_dir, job_id)
+        raise
+    return job_id
+
+
+def read_job_status(jobs_dir: str, job_id: str) -> Tuple[int, str]:
+    with open(os.path.join(jobs_dir, job_id + JOB_STATUS_EXT)) as f:
+        [exit_code, *msg] = f.read().split('\n', 1)
+    return int(exit_code.strip()), ''.join(msg).strip()
+
+
+def cleanup_job(jobs_dir: str, job_id: str) -> None:
+    for ext in (
+        JOB_COMMAND_EXT, JOB_COMMAND_EXT + JOB_TEMP_EXT, JOB_RUNNING_EXT, JOB_STATUS_EXT, JOB_AUTH_EXT, JOB_DEADLINE_EXT,
+    ):
+        try:
+            os.remove(os.path.join(jobs_dir, job_id + ext))
+        except OSError:
+            pass
+
+
+def run_osmosis_job(
+    jobs_dir: str,
+    command: str,
+    deadline_secs: float,
+    pickup_timeout_secs: float = 30,
+    poll_interval_secs: float = 0.5,
+    auth: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    Runs the shell command through the job runner and waits for it to finish, see submit_job().
+    Raises exception if the command fails, is not picked up by the runner within `pickup_timeout_secs`
+    or does not finish within `deadline_secs`, which the runner enforces too. Files of the job are removed
+    however it ends, which makes the runner kill the job if it is still running.
+    """
+    job_id = submit_job(jobs_dir, command, auth, deadline_secs)
+    command_path = os.path.join(jobs_dir, job_id + JOB_COMMAND_EXT)
+    status_path = os.path.join(jobs_dir, job_id + JOB_STATUS_EXT)
+    started_at = time.monotonic()
+    logger.info(f'Submitted osmosis job {job_id}')
+    try:
+        while not os.path.exists(status_path):
+            waited_secs = time.monotonic() - started_at
+            if os.path.exists(command_path) and waited_secs > pickup_timeout_secs:
+                raise Exception(
+                    f'Osmosis job {job_id} was not picked up in {pickup_timeout_secs} seconds, '
+                    'check that scripts/pipe_reader_writer.sh is running, as root or as the owner of the job files'
+                )
+            if waited_secs > deadline_secs:
+                raise Exception(f'Osmosis job {job_id} did not finish in {deadline_secs} seconds')
+            time.sleep(poll_interval_secs)
+
+        exit_code, msg = read_job_status(jobs_dir, job_id)
+        logger.info(f'Osmosis job {job_id} finished in {time.monotonic() - started_at:.1f} seconds')
+        if exit_code != 0:
+            raise Exception(f'Osmosis job failed with exit code {exit_code}: {msg}')
+    finally:
+        # A job which timed out before being picked up is dropped as well
+        cleanup_job(jobs_dir, job_id)
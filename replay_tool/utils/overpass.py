@@ -0,0 +1,234 @@
+import os
+import math
+import re
+import shutil
+import time
+
+import requests
+
+from xml.etree import ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from .http import get_http_client
+from .extract_cache import ExtractCache
+from .osm_files import merge_osm_files
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Overpass reports errors that occur after the response has started inside a remark element
+REMARK_PATTERN = re.compile(rb'<remark>(.*?)</remark>', re.S)
+RUNTIME_ERROR_PREFIX = b'runtime error'
+TIMEOUT_REMARKS = (b'timed out', b'out of memory')
+# Timestamp of the overpass database the data was queried from
+OSM_BASE_PATTERN = re.compile(rb'<meta [^>]*osm_base="([^"]+)"')
+# Transient failures of a download, a response cut off mid-stream shows up as a chunked encoding or
+# decoding error of the gzipped body
+RETRIED_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+class OverpassTimeoutError(Exception):
+    pass
+
+
+def read_head_and_tail(path: str, size: int = 4096):
+    with open(path, 'rb') as f:
+        head = f.read(size)
+        f.seek(max(os.path.getsize(path) - size, 0))
+        tail = f.read()
+    return head, tail
+
+
+def validate_osm_file(path: str) -> Optional[str]:
+    """
+    Checks that the downloaded file is complete osm xml and not an overpass error.
+    Returns the osm_base timestamp of the data, if overpass included it.
+    """
+    head, tail = read_head_and_tail(path)
+    if b'<osm' not in head:
+        raise Exception(f'Overpass response is not osm data: {head[:200]!r}')
+    for remark in REMARK_PATTERN.findall(tail):
+        remark = remark.strip()
+        if not remark.startswith(RUNTIME_ERROR_PREFIX):
+            continue
+        if any(x in remark for x in TIMEOUT_REMARKS):
+            raise OverpassTimeoutError(remark.decode('utf-8', 'replace'))
+        raise Exception(f"Overpass error: {remark.decode('utf-8', 'replace')}")
+    if b'</osm>' not in tail:
+        raise Exception('Overpass response is incomplete')
+    match = OSM_BASE_PATTERN.search(head)
+    return match.group(1).decode() if match else None
+
+
+def stream_to_file(overpass_api_url: str, query: str, path: str) -> None:
+    with get_http_client().get(overpass_api_url, data={'data': query}, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f'Status code {response.status_code} while querying overpass')
+        with open(path, 'wb') as f:
+            # Only a chunk is in memory at a time, gzip encoded responses are decoded on the fly
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                f.write(chunk)
+
+
+def download_overpass_query(
+    overpass_api_url: str,
+    query: str,
+    path: str,
+    retries: int = 3,
+    backoff_secs: float = 10,
+    cache: Optional[ExtractCache] = None,
+) -> Optional[str]:
+    """
+    Streams result of the overpass query to a temporary file next to `path`, validates it and
+    then atomically renames it to `path`, so `path` never holds partial or error data.
+    Timeouts, connection errors, responses cut off mid-stream and overpass timeout remarks are retried
+    with exponential backoff.
+    Overpass does not support range requests, so a retry downloads the result from the start.
+    Returns the osm_base timestamp of the data.
+    A fresh result of the same query from `cache` is used instead of downloading it again.
+    """
+    if not overpass_api_url:
+        raise Exception('overpass_api_url not configured')
+    cache_key = cache and cache.get_key(overpass_api_url, query)
+    if cache:
+        osm_base = cache.get(cache_key, path)
+        if osm_base:
+            return osm_base
+    temp_path = f'{path}.part'
+    error: Optional[Exception] = None
+    for attempt in range(retries + 1):
+        if attempt:
+            wait_secs = backoff_secs * 2 ** (attempt - 1)
+            logger.warning(f'Overpass download failed ({error}), retrying in {wait_secs}s')
+            time.sleep(wait_secs)
+        try:
+            stream_to_file(overpass_api_url, query, temp_path)
+            osm_base = validate_osm_file(temp_path)
+            os.replace(temp_path, path)
+            if cache:
+                cache.put(cache_key, path, osm_base)
+            return osm_base
+        except (*RETRIED_ERRORS, OverpassTimeoutError) as e:
+            error = e
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    raise Exception(f'Overpass download failed after {retries + 1} attempts: {error}')
+
+
+def get_tile_bboxes(bbox: List[float], tile_size: float) -> List[List[float]]:
+    """Splits [w, s, e, n] bbox into a grid of tiles of at most `tile_size` degrees"""
+    [w, s, e, n] = bbox
+    # Tolerance so that a bbox which is a multiple of tile size does not get an extra sliver of tiles
+    cols = max(1, math.ceil((e - w) / tile_size - 1e-9))
+    rows = max(1, math.ceil((n - s) / tile_size - 1e-9))
+    tile_w = (e - w) / cols
+    tile_h = (n - s) / rows
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            # Use the bbox edges for the last tiles, so floating point errors don't leave gaps
+            tiles.append([
+                w + col * tile_w,
+                s + row * tile_h,
+                e if col == cols - 1 else w + (col + 1) * tile_w,
+                n if row == rows - 1 else s + (row + 1) * tile_h,
+            ])
+    return tiles
+
+
+def download_overpass_queries(
+    overpass_api_url: str,
+    queries: List[str],
+    path: str,
+    workers: int = 2,
+    retries: int = 3,
+    backoff_secs: float = 10,
+    cache: Optional[ExtractCache] = None,
+) -> Optional[str]:
+    """
+    Downloads results of the queries concurrently with at most `workers` overpass queries at a time
+    and merges them into `path`. Elements present in several results are kept once.
+    Each query is retried on its own, so a failed query does not restart the whole download.
+    Returns the oldest osm_base timestamp of the results.
+    """
+    parts_dir = f'{path}.parts'
+    os.makedirs(parts_dir, exist_ok=True)
+
+    def download_part(index: int) -> Tuple[str, Optional[str]]:
+        part_path = os.path.join(parts_dir, f'part-{index}.osm')
+        osm_base = download_overpass_query(
+            overpass_api_url, queries[index], part_path, retries=retries, backoff_secs=backoff_secs, cache=cache,
+        )
+        logger.info(f'Downloaded part {index + 1} of {len(queries)}')
+        return part_path, osm_base
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            parts = list(executor.map(download_part, range(len(queries))))
+        merge_osm_files([part_path for part_path, _ in parts], path)
+        # Timestamps are all in the same iso format, so they compare as strings
+        return min((osm_base for _, osm_base in parts if osm_base), default=None)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+def download_tiled_overpass_query(
+    overpass_api_url: str,
+    get_query: Callable[[float, float, float, float], str],
+    bbox: List[float],
+    path: str,
+    tile_size: float,
+    **kwargs,
+) -> Optional[str]:
+    """
+    Splits the bbox into tiles and downloads them concurrently into `path`, see download_overpass_queries()
+    @get_query: callable(s, w, n, e) returning the overpass query for a tile
+    """
+    tiles = get_tile_bboxes(bbox, tile_size)
+    logger.info(f'Downloading upstream extract in {len(tiles)} tiles')
+    queries = [get_query(s, w, n, e) for [w, s, e, n] in tiles]
+    return download_overpass_queries(overpass_api_url, queries, path, **kwargs)
+
+
+def adiff_to_osmchange(adiff_path: str, osc_path: str) -> int:
+    """
+    Converts an overpass augmented diff to osmChange, returns number of changes.
+    Elements which are deleted upstream become deletes. Elements which just left the query
+    result, like ways moved out of the bbox, still exist upstream and become modifies.
+    """
+    count = 0
+    with open(osc_path, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osmChange version="0.6" generator="POSM Replay Tool">\n')
+        root = None
+        for event, elem in ET.iterparse(adiff_path, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event != 'end' or elem.tag != 'action':
+                continue
+            if elem.get('type') == 'create':
+                change, element = 'create', elem[0]
+            else:
+                old, new = elem.find('old'), elem.find('new')
+                if new is not None and len(new) and new[0].get('visible') != 'false':
+                    change, element = 'modify', new[0]
+                else:
+                    change, element = 'delete', new[0] if new is not None and len(new) else old[0]
+            element.tail = None
+            f.write(f'<{change}>'.encode())
+            f.write(ET.tostring(element))
+            f.write(f'</{change}>\n'.encode())
+            count += 1
+            # Only the current action is kept in memory
+            root.clear()
+        f.write(b'</osmChange>\n')
+    return count
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime
+
+from replay_tool.models import ReplayTool
+
+
+class ProgressRecorder:
+    """
+    Records progress of a long running stage in ReplayTool.progress, so that the api can show
+    how much is done, the throughput and the estimated time remaining.
+    The progress is saved at most once every `interval_secs`.
+    """
+    def __init__(self, stage: str, total: int, interval_secs: float = 2):
+        self.stage = stage
+        self.total = total
+        self.processed = 0
+        self.interval_secs = interval_secs
+        self.started_at = datetime.utcnow()
+        self._start = time.monotonic()
+        self._last_saved = 0.0
+        self.save()
+
+    def as_dict(self) -> dict:
+        elapsed = time.monotonic() - self._start
+        throughput = self.processed / elapsed if elapsed > 0 else 0
+        remaining = max(self.total - self.processed, 0)
+        return {
+            'stage': self.stage,
+            'processed': self.processed,
+            'total': self.total,
+            'started_at': self.started_at.isoformat(),
+            'elapsed_secs': round(elapsed, 1),
+            'throughput_per_sec': round(throughput, 2),
+            'eta_secs': round(remaining / throughput, 1) if throughput else None,
+        }
+
+    def save(self) -> None:
+        # Only update the progress, the rest of the replay tool is managed elsewhere
+        ReplayTool.objects.filter(pk=1).update(progress=self.as_dict())
+        self._last_saved = time.monotonic()
+
+    def advance(self, count: int = 1) -> None:
+        self.processed += count
+        if time.monotonic() - self._last_saved >= self.interval_secs:
+            self.save()
+
+    def finish(self) -> None:
+        self.processed = self.total
+        self.save()
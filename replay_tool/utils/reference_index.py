@@ -0,0 +1,71 @@
+from array import array
+from bisect import bisect_left
+
+from typing import Iterator, List, Optional, Set, Tuple
+
+
+class ReverseReferenceIndex:
+    """
+    Maps node ids to ids of the ways or relations referring to them.
+    References are appended to two int64 arrays while scanning and are frozen, on first lookup,
+    into CSR form: sorted unique node ids, offsets into them and referrer ids grouped by node.
+    Referrers of a node keep the order they were added in.
+    """
+    def __init__(self):
+        self._node_ids = array('q')
+        self._referrer_ids = array('q')
+        self._keys: Optional[array] = None
+        self._offsets: Optional[array] = None
+        self._values: Optional[array] = None
+
+    def add(self, node_id: int, referrer_id: int) -> None:
+        if self._keys is not None:
+            raise Exception('Cannot add references to a frozen index')
+        self._node_ids.append(node_id)
+        self._referrer_ids.append(referrer_id)
+
+    def freeze(self) -> None:
+        if self._keys is not None:
+            return
+        # sorted() is stable, so referrers stay in the order they were added
+        order = sorted(range(len(self._node_ids)), key=self._node_ids.__getitem__)
+        keys, offsets, values = array('q'), array('q'), array('q')
+        for i in order:
+            node_id = self._node_ids[i]
+            if not keys or keys[-1] != node_id:
+                keys.append(node_id)
+                offsets.append(len(values))
+            values.append(self._referrer_ids[i])
+        offsets.append(len(values))
+        self._keys, self._offsets, self._values = keys, offsets, values
+        self._node_ids, self._referrer_ids = array('q'), array('q')
+
+    def _find(self, node_id: int) -> int:
+        self.freeze()
+        i = bisect_left(self._keys, node_id)
+        return i if i < len(self._keys) and self._keys[i] == node_id else -1
+
+    def referrers_of(self, node_id: int) -> List[int]:
+        i = self._find(node_id)
+        if i < 0:
+            return []
+        return self._values[self._offsets[i]:self._offsets[i + 1]].tolist()
+
+    def get(self, node_id: int, default=None) -> Optional[List[int]]:
+        return self.referrers_of(node_id) if node_id in self else default
+
+    def items(self) -> Iterator[Tuple[int, List[int]]]:
+        self.freeze()
+        for i, node_id in enumerate(self._keys):
+            yield node_id, self._values[self._offsets[i]:self._offsets[i + 1]].tolist()
+
+    def referrer_ids(self) -> Set[int]:
+        self.freeze()
+        return set(self._values)
+
+    def __contains__(self, node_id: int) -> bool:
+        return self._find(node_id) >= 0
+
+    def __len__(self) -> int:
+        self.freeze()
+        return len(self._keys)
@@ -1,6 +1,7 @@
+from datetime import datetime, timezone
 from xml.etree import ElementTree as ET
 
-from typing import Dict, Union
+from typing import Dict, Optional, Union
 
 
 StrOrInt = Union[str, int]
@@ -57,3 +58,32 @@ class ChangesetsToXMLWriter:
 
     def get_xml(self) -> str:
         return ET.tostring(self.root, encoding='utf-8')
+
+
+def _get_float(elem: ET.Element, attr: str) -> Optional[float]:
+    value = elem.get(attr)
+    return float(value) if value is not None else None
+
+
+def parse_changeset_meta(meta_xml: str) -> dict:
+    """
+    Parses changeset meta xml as returned by /api/0.6/changeset/#id into attributes of LocalChangeSet.
+    Changesets without any located element have no bounds.
+    """
+    changeset = ET.fromstring(meta_xml).find('changeset')
+    if changeset is None:
+        raise Exception('Invalid changeset meta, changeset element not found')
+    created_at = changeset.get('created_at')
+    num_changes = changeset.get('changes_count')
+    return {
+        'created_at': (
+            datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+            if created_at else None
+        ),
+        'num_changes': int(num_changes) if num_changes is not None else None,
+        'user': changeset.get('user'),
+        'min_lat': _get_float(changeset, 'min_lat'),
+        'min_lon': _get_float(changeset, 'min_lon'),
+        'max_lat': _get_float(changeset, 'max_lat'),
+        'max_lon': _get_float(changeset, 'max_lon'),
+    }
@@ -0,0 +1,68 @@
+from array import array
+from bisect import bisect_left
+
+from typing import Dict, Iterator, Optional, Tuple
+
+
+class VersionIndex:
+    """
+    Versions of elements by id, in an int64 array of ids and an int32 array of versions.
+    Elements come sorted by id from osm files, if not, the arrays are sorted on the first lookup.
+    """
+    def __init__(self):
+        self._ids = array('q')
+        self._versions = array('i')
+        self._sorted = True
+
+    def add(self, eid: int, version: int) -> None:
+        if self._ids and eid <= self._ids[-1]:
+            self._sorted = False
+        self._ids.append(eid)
+        self._versions.append(version)
+
+    def _sort(self) -> None:
+        if self._sorted:
+            return
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        self._ids = array('q', (self._ids[i] for i in order))
+        self._versions = array('i', (self._versions[i] for i in order))
+        self._sorted = True
+
+    def get(self, eid: int, default: Optional[int] = None) -> Optional[int]:
+        self._sort()
+        i = bisect_left(self._ids, eid)
+        return self._versions[i] if i < len(self._ids) and self._ids[i] == eid else default
+
+    def __getitem__(self, eid: int) -> int:
+        version = self.get(eid)
+        if version is None:
+            raise KeyError(eid)
+        return version
+
+    def __contains__(self, eid: int) -> bool:
+        return self.get(eid) is not None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        self._sort()
+        return zip(self._ids, self._versions)
+
+    def filter_newer(self, elements: Dict[int, dict]) -> Dict[int, dict]:
+        """
+        Elements, by id, whose version is greater than the one in the index, which have no version
+        or which are not in the index. Ids are matched by walking both in id order, instead of a
+        lookup for each element.
+        """
+        self._sort()
+        ids, versions = self._ids, self._versions
+        i, count = 0, len(ids)
+        newer = {}
+        for eid in sorted(elements):
+            element = elements[eid]
+            while i < count and ids[i] < eid:
+                i += 1
+            if not element.get('version') or i == count or ids[i] != eid or element['version'] > versions[i]:
+                newer[eid] = element
+        return newer
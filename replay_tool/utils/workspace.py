@@ -0,0 +1,92 @@
+import json
+import os
+import pickle
+import shutil
+import uuid
+
+from datetime import datetime
+
+from typing import Any, Optional
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Layout of the workspace directory
+#   runs/<run_id>/: files of a run of the pipeline, like the referenced osm files and pickled checkpoints
+#   checkpoint.json: the latest checkpoint, the stage it is for and the run it belongs to
+RUNS_DIR_NAME = 'runs'
+CHECKPOINT_FILE_NAME = 'checkpoint.json'
+
+
+def read_checkpoint_info(workspace_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(workspace_dir, CHECKPOINT_FILE_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def create_run_workspace(workspace_dir: str, keep_runs: int) -> str:
+    """
+    Creates the directory for a new run and returns its path. Only the latest `keep_runs` runs are kept,
+    along with the run of the latest checkpoint.
+    """
+    runs_dir = os.path.join(workspace_dir, RUNS_DIR_NAME)
+    run_id = f'{datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")}-{uuid.uuid4().hex[:8]}'
+    run_dir = os.path.join(runs_dir, run_id)
+    # Checkpoints are unpickled, only the owner may write to the workspace
+    for path in (workspace_dir, runs_dir):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    os.makedirs(run_dir, mode=0o700)
+
+    checkpoint = read_checkpoint_info(workspace_dir) or {}
+    old_runs = sorted(os.listdir(runs_dir), reverse=True)[max(keep_runs, 1):]
+    for name in old_runs:
+        path = os.path.join(runs_dir, name)
+        if path != checkpoint.get('run_dir'):
+            shutil.rmtree(path, ignore_errors=True)
+    return run_dir
+
+
+def save_checkpoint(workspace_dir: str, run_dir: str, stage: str, data: Any, **info) -> None:
+    """
+    Pickles data into the run directory and marks it as the latest checkpoint, for the stage.
+    @info: what the checkpoint is valid for, checked by load_checkpoint()
+    """
+    data_path = os.path.join(run_dir, f'{stage}.pickle')
+    with open(data_path + '.part', 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(data_path + '.part', data_path)
+
+    checkpoint_path = os.path.join(workspace_dir, CHECKPOINT_FILE_NAME)
+    with open(checkpoint_path + '.part', 'w') as f:
+        json.dump({
+            'stage': stage,
+            'run_dir': run_dir,
+            'data_path': data_path,
+            'created_at': datetime.utcnow().isoformat(),
+            'info': info,
+        }, f)
+    os.replace(checkpoint_path + '.part', checkpoint_path)
+    logger.info(f'Saved checkpoint of {stage} to {data_path}')
+
+
+def is_inside(path: str, directory: str) -> bool:
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory and path != directory
+
+
+def load_checkpoint(workspace_dir: str, stage: str, **info) -> Any:
+    """
+    Data of the latest checkpoint, raises exception if it is not for the stage or for the info given.
+    Only data inside a run directory of the workspace is unpickled.
+    """
+    checkpoint = read_checkpoint_info(workspace_dir)
+    if not checkpoint or checkpoint['stage'] != stage or checkpoint['info'] != info:
+        raise Exception(f'No checkpoint of {stage} found in {workspace_dir}, the stage needs to be run again')
+    run_dir, data_path = checkpoint['run_dir'], checkpoint['data_path']
+    if not is_inside(run_dir, os.path.join(workspace_dir, RUNS_DIR_NAME)) or not is_inside(data_path, run_dir):
+        raise Exception(f'Checkpoint data {data_path} is not inside a run of {workspace_dir}')
+    with open(data_path, 'rb') as f:
+        return pickle.load(f)
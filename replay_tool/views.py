@@ -12,7 +12,7 @@ from social_django.utils import psa
 
 from .tasks import task_prepare_data_for_replay_tool
 
-from .models import ReplayTool, OSMElement, ReplayToolConfig, LocalChangeSet
+from .models import ReplayTool, OSMElement, ReplayToolConfig
 from .serializers.models import (
     ReplayToolSerializer,
     OSMElementSerializer,
@@ -59,7 +59,7 @@ def retrigger(request):
     replay_tool = ReplayTool.objects.get()
     RT = ReplayTool
     if replay_tool.state == RT.STATUS_GATHERING_CHANGESETS:
-        LocalChangeSet.objects.all().delete()
+        # Nothing extra to be done, gathering resumes after the last gathered changeset
         replay_tool.state = RT.STATUS_NOT_TRIGGERRED
     elif replay_tool.state == RT.STATUS_EXTRACTING_UPSTREAM_AOI:
         # Nothing extra to be done, just creates files, which will be overridden
@@ -78,8 +78,8 @@ def retrigger(request):
         OSMElement.objects.all().delete()
     elif replay_tool.state == RT.STATUS_PUSH_CONFLICTS:
         replay_tool.state = RT.STATUS_NOT_TRIGGERRED
-        # Remove changesets
-        LocalChangeSet.objects.all().delete()
+        # Don't remove the changesets, the pushed ones are marked processed and only
+        # newer changesets will be gathered
         # Don't remove the OSMElements, they will be reused
 
     replay_tool.has_errored = False
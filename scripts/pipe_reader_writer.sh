@@ -1,29 +1,79 @@
 #!/bin/bash
 
-# Create a pipe to read
-# Delete if already exists
-rm /tmp/osmosis_command/command_reader.fifo 2>/dev/null
-mkfifo /tmp/osmosis_command/command_reader.fifo
+# Runs osmosis jobs submitted by the python app, from outside docker
+# A job is a shell command in <jobs_dir>/<job_id>.cmd. It is renamed to <job_id>.running while
+# it runs and its result is written to <job_id>.status: exit code on the first line, followed
+# by the error output. Database credentials of a job are in <job_id>.auth, passed to the command
+# as $JOB_AUTH_FILE. The job is killed after the seconds in <job_id>.deadline, or as soon as the app
+# removes <job_id>.running because it stopped waiting. See replay_tool/utils/osmosis.py
+#
+# The job files are written by the app inside docker, readable only by their owner (root, as the
+# container runs as root), so this has to run as the same user or as root.
+# The jobs dir must be the host side of the /tmp/osmosis_command mount in docker-compose.yml,
+# which is ./tmp/osmosis_command relative to the repo.
+REPO_DIR=$(cd "$(dirname "$0")/.." && pwd)
+JOBS_DIR=${OSMOSIS_HOST_JOBS_DIR:-$REPO_DIR/tmp/osmosis_command/jobs}
+POLL_INTERVAL_SECS=${OSMOSIS_JOBS_POLL_INTERVAL_SECS:-0.5}
+# Used if a job has no deadline file
+DEFAULT_DEADLINE_SECS=${OSMOSIS_JOB_DEADLINE_SECS:-3600}
+# A killed job which ignores SIGTERM gets SIGKILL after this
+KILL_AFTER_SECS=10
 
-rm /tmp/osmosis_command/result_reader.fifo 2>/dev/null
-mkfifo /tmp/osmosis_command/result_reader.fifo
+mkdir -p $JOBS_DIR
 
+write_status() {
+    # Write and then rename, so the app never reads a partially written status
+    printf '%s\n%s\n' "$2" "$3" > $1.status.tmp
+    mv $1.status.tmp $1.status
+}
+
+# Jobs left running by a previous runner won't finish anymore
+for running in $JOBS_DIR/*.running; do
+    [ -e "$running" ] || continue
+    job=${running%.running}
+    write_status "$job" 1 "Job runner restarted while the job was running"
+    rm -f "$job.auth" "$job.deadline"
+done
 
 while true
 do
-    while read cmd
-    do
-        $cmd 2> /tmp/osmosis_command/command_reader_error;
-        # Write to another named pipe '/tmp/osmosis_command/result_reader.fifo' which is created by python app
-        # NOTE: the following outputs multiline errors into single, which is desired
-        # at the moment
+    for cmd in $JOBS_DIR/*.cmd; do
+        [ -e "$cmd" ] || continue
+        job=${cmd%.cmd}
+        if [ ! -r "$cmd" ]; then
+            echo "Can not read $cmd owned by uid $(stat -c %u "$cmd"), run this as that user or as root" >&2
+            continue
+        fi
+        # Claim the job, skip it if it is already gone
+        mv "$cmd" "$job.running" 2>/dev/null || continue
+
+        deadline_secs=$(cat "$job.deadline" 2>/dev/null || echo $DEFAULT_DEADLINE_SECS)
+        # timeout runs the job in its own process group and kills the whole group, osmosis included
+        JOB_AUTH_FILE="$job.auth" timeout --kill-after=$KILL_AFTER_SECS "$deadline_secs" \
+            bash "$job.running" 2> "$job.err" &
+        pid=$!
+        withdrawn=
+        while kill -0 $pid 2>/dev/null; do
+            # The app removes the job if it stops waiting for it, then nobody wants its output
+            if [ ! -e "$job.running" ]; then
+                withdrawn=1
+                kill -TERM $pid 2>/dev/null
+            fi
+            sleep $POLL_INTERVAL_SECS
+        done
+        wait $pid
         errcode=$?
-        if [[ $errcode -ne 0 ]]; then
-            errmsg=`cat /tmp/osmosis_command/command_reader_error`
+        if [[ $errcode -eq 124 ]]; then
+            errmsg="Job killed after the deadline of $deadline_secs seconds"
+        elif [[ $errcode -ne 0 ]]; then
+            errmsg=`cat $job.err`
         else
-            errmsg="no errrors reported"
+            errmsg="no errors reported"
+        fi
+        if [ -z "$withdrawn" ] && [ -e "$job.running" ]; then
+            write_status "$job" "$errcode" "$errmsg"
         fi
-        echo "$? $errmsg" >> /tmp/osmosis_command/result_reader.fifo
-    done < /tmp/osmosis_command/command_reader.fifo
-    sleep 1
+        rm -f "$job.running" "$job.err" "$job.auth" "$job.deadline"
+    done
+    sleep $POLL_INTERVAL_SECS
 done